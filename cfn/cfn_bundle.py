@@ -18,15 +18,31 @@ It supports layered architecture of cloud formation templates infering variables
 """
 import boto3
 import logging
-import json
+import multiprocessing
 import time
 import yaml
 import pystache
 import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from pathlib import Path
-from cfn.cfn_stack import CFNStack, CFNStackData
-from cfn.cfn_client import StackFailStatus, StackSuccessStatus
-from common import s3bucket
+from cfn.cfn_stack import CFNStack, CFNStackData, render_stack
+from cfn.cfn_client import StackFailStatus, PollingPolicy
+from cfn.cfn_scheduler import StackScheduler
+from cfn.cfn_state import StackDigestStore, StackOutputsStore, state_path
+from cfn.cfn_journal import DeployJournal
+from common.s3bucket import TemplateBucket
+
+class StackDependencyException(Exception):
+    pass
+
+
+# states of a stack in CFBundle.plan
+PLAN_UNCHANGED = 'unchanged'
+PLAN_CHANGED = 'changed'
+PLAN_NEW = 'new'
+PLAN_ERROR = 'error'
+PLAN_STATES = [PLAN_UNCHANGED, PLAN_CHANGED, PLAN_NEW, PLAN_ERROR]
+
 
 class CFBundle(object):
     """
@@ -40,21 +56,57 @@ class CFBundle(object):
         self.stack_map = dict()
         self.dependency_map = dict()
 
-        file = Path(yaml_file).resolve()
-        self.path = file.parent
-
-        file_handle = open(file, 'r')
-        rendered_file = pystache.render(file_handle.read(), dict(os.environ))
-        self.input = yaml.safe_load(rendered_file)
+        self.path = Path(yaml_file).resolve().parent
+        self.input = CFBundle.read_input(yaml_file)
         self.config = self.input.get('config', {})
         self.tags = self.config.get('tags', {})
 
         self.name = self.sanitize_name(self.config.get('bundle_name', 'bundle'))
         self.aws_region = self.config.get('aws_region', None)
+        # account and region this copy of the bundle is deployed to by FanoutBundle, overrides aws_region
+        self.target_account = kwargs.pop('target_account', None)
+        self.target_region = kwargs.pop('target_region', None)
+        if self.target_region:
+            self.aws_region = self.target_region
+        # name of the local state files, unique per target
+        self.state_name = ".".join(part for part in (self.name, self.target_account, self.target_region) if part)
 
         self.aws_profile = kwargs.get('aws_profile', self.config.get('aws_profile', None))
-        self.aws_account = self.config.get('aws_account', None)
+        self.aws_account = kwargs.get('aws_account', self.config.get('aws_account', None))
         kwargs['aws_account'] = self.aws_account
+        # adaptive polling of stack status, see PollingPolicy
+        kwargs['polling'] = self.config.get('polling', None)
+        # compiled jinja templates kept on disk across runs, relative to the bundle file
+        template_cache_dir = self.config.get('template_cache_dir', None)
+        if template_cache_dir:
+            kwargs['template_cache_dir'] = Path(self.path, template_cache_dir)
+
+        # scheduling of stack operations, command line wins over the bundle config
+        max_parallel = kwargs.pop('max_parallel_stacks', None)
+        self.max_parallel_stacks = int(max_parallel or self.config.get('max_parallel_stacks', 4))
+        # stack threads and the stack poller share one cloudformation client and its connections
+        kwargs['max_pool_connections'] = int(self.config.get('max_pool_connections', max(10, self.max_parallel_stacks + 2)))
+        on_failure = kwargs.pop('on_failure', None)
+        self.on_failure = on_failure or self.config.get('on_failure', StackScheduler.FAIL_FAST)
+        # worker processes rendering templates ahead of deployment, 1 renders each stack when it is deployed
+        compile_workers = kwargs.pop('compile_workers', None)
+        self.compile_workers = int(compile_workers or self.config.get('compile_workers', 1))
+        # continue the deployment recorded in the journal of the previous run
+        self.resume = kwargs.pop('resume', False)
+        # deploy stacks even if nothing changed since the last deployment
+        self.force = kwargs.pop('force', False) or self.config.get('force_update', False)
+        self.digest_store = StackDigestStore(state_path(self.path, self.state_name, 'digests.json'))
+        # upstream stack variables shared by all stacks, kept on disk with persist_outputs for offline compiles
+        self.offline = kwargs.pop('offline', False)
+        persist_outputs = self.offline or self.config.get('persist_outputs', False)
+        self.outputs_store = StackOutputsStore(state_path(self.path, self.state_name, 'outputs.json') if persist_outputs else None,
+                                               offline=self.offline)
+        # rendered templates are uploaded on the first deployment only, nothing is created up front
+        template_bucket = self.name + "CFTemplates"
+        if self.target_region:
+            # bucket names are global, every target region has its own bucket
+            template_bucket = "%s-%s" % (template_bucket, self.target_region)
+        self.template_bucket = TemplateBucket(template_bucket, self.aws_region, **kwargs)
 
         # create CFStack instances
         input_stacks = self.input['stacks']
@@ -63,6 +115,8 @@ class CFBundle(object):
 
             stack_name = stack_def.get('name', "%s%s" % (self.name, stack_key))
             stack_name = self.sanitize_name(stack_name)
+            if self.target_region and 'aws_region' in stack_def:
+                raise Exception("Stack %s pins aws_region, which can't be combined with aws_regions" % stack_key)
             stack_region = stack_def.get('aws_region', self.aws_region)
 
             if stack_def.get('enabled', True):
@@ -83,6 +137,9 @@ class CFBundle(object):
                                    tags = stack_tags,
                                    sns_topic_arn='',
                                    **kwargs)
+                cf_stack.digest_store = self.digest_store
+                cf_stack.outputs_store = self.outputs_store
+                cf_stack.template_bucket = self.template_bucket
                 self.stack_map[stack_key] = cf_stack
                 self.dependency_map[stack_key] = stack_deps
             else:
@@ -90,6 +147,7 @@ class CFBundle(object):
                                     name=stack_name,
                                     aws_region=stack_region,
                                     **kwargs)
+                cf_stack.outputs_store = self.outputs_store
 
                 self.stack_map[stack_key] = cf_stack
 
@@ -102,8 +160,18 @@ class CFBundle(object):
                     raise Exception('Dependency stack %s for %s not defined ' % (key,stack.key))
                 stack.add_dependency(dep_stack)
 
+        self.waves = self.sort_waves()
         self.stacks = self.sort_stacks()
-        s3bucket.init(self.name+ "CFTemplates")
+
+    @staticmethod
+    def read_input(yaml_file):
+        """
+        Read a bundle file, environment variables are substituted before it is parsed
+        :rtype: dict
+        """
+        with open(Path(yaml_file).resolve(), 'r') as file_handle:
+            rendered_file = pystache.render(file_handle.read(), dict(os.environ))
+        return yaml.safe_load(rendered_file)
 
     def sanitize_name(self, name, delimiter=None):
         if delimiter is None:
@@ -125,46 +193,140 @@ class CFBundle(object):
         """
         Sort the array of stack_objs so they are in dependancy order
         """
-        sorted_stacks = []
-        dep_graph = {}
-        no_deps = []
-        # Add all stacks without dependancies to no_deps
+        return [stack for wave in self.waves for stack in wave]
+
+    def sort_waves(self):
+        """
+        Group stacks into waves using Kahn's algorithm. Every stack of a wave only depends on stacks of
+        earlier waves, so all stacks of a wave can be deployed at the same time.
+        Stacks keep the order of the bundle file within a wave.
+        :return: list of waves, each a list of stacks
+        :rtype: list of list of CFNStack
+        """
+        position = dict((key, index) for index, key in enumerate(self.stack_map))
+        in_degree = dict()
+        dependents = dict((key, []) for key in self.stack_map)
         for stack in self.stack_map.values():
-            if len(stack.depends_on) <= 0:
-                no_deps.append(stack)
-            else:
-                dep_graph[stack.key] = []
-                for dep_key in stack.depends_on.keys():
-                    if self.stack_map.get(dep_key, None):
-                        dep_graph[stack.key].append(dep_key)
-
-                if len(dep_graph[stack.key]) == 0:
-                    del dep_graph[stack.key]
-                    no_deps.append(stack)
-
-        # Perform a topological sort on stacks in dep_graph
-        while len(no_deps) > 0:
-            stack = no_deps.pop()
-            sorted_stacks.append(stack)
-            for node in list(dep_graph.keys()):
-                for dep_name in dep_graph[node]:
-                    if stack.key == dep_name:
-                        dep_graph[node].remove(dep_name)
-                        if len(dep_graph[node]) < 1:
-                            leaf_stack = self.stack_map[node]
-                            no_deps.append(leaf_stack)
-                            del dep_graph[node]
-        if len(dep_graph) > 0:
-            self.logger.critical("Stack dependency not found or circular dependency exist")
-            self.logger.critical(json.dumps(dep_graph))
-            exit(1)
-        else:
-            return sorted_stacks
+            deps = [dep_key for dep_key in stack.depends_on.keys() if dep_key in self.stack_map]
+            in_degree[stack.key] = len(deps)
+            for dep_key in deps:
+                dependents[dep_key].append(stack.key)
+
+        waves = []
+        wave = [stack for stack in self.stack_map.values() if in_degree[stack.key] == 0]
+        while wave:
+            waves.append(wave)
+            next_wave = []
+            for stack in wave:
+                for dep_key in dependents[stack.key]:
+                    in_degree[dep_key] -= 1
+                    if in_degree[dep_key] == 0:
+                        next_wave.append(self.stack_map[dep_key])
+            wave = sorted(next_wave, key=lambda s: position[s.key])
+
+        remaining = [key for key, degree in in_degree.items() if degree > 0]
+        if remaining:
+            cycle = self._find_cycle(remaining)
+            raise StackDependencyException("Circular dependency between stacks: %s" % " -> ".join(cycle))
+
+        return waves
+
+    def _find_cycle(self, keys):
+        """
+        Walk the dependencies of stacks left over by the topological sort until a stack repeats.
+        Each of them still has an unresolved dependency, so the walk always ends up in a cycle.
+        """
+        keys = set(keys)
+        path = []
+        seen = dict()
+        key = min(keys)
+        while key not in seen:
+            seen[key] = len(path)
+            path.append(key)
+            key = next(dep_key for dep_key in self.stack_map[key].depends_on.keys() if dep_key in keys)
+        return path[seen[key]:] + [key]
 
     def create_update_bundle(self):
+        """
+        Create or update all enabled stacks, running independent stacks concurrently
+        :return: map of stack key to (result, status), see StackScheduler.run
+        """
+        if self.compile_workers > 1:
+            self.compile_all()
+        scheduler = StackScheduler(self.stacks, max_parallel=self.max_parallel_stacks, on_failure=self.on_failure)
+        return self._run_journaled(scheduler, lambda stack: stack.create_update_stack(force=self.force, resume=self.resume)
+                                   if stack.enabled else None)
+
+    def _run_journaled(self, scheduler, operation):
+        """
+        Run a deployment recording every stack phase in the journal of the bundle, see DeployJournal
+        """
+        journal = DeployJournal(state_path(self.path, self.state_name, 'journal'), resume=self.resume)
+        for stack in scheduler.stacks:
+            stack.journal = journal
+        try:
+            return scheduler.run(operation)
+        finally:
+            for stack in scheduler.stacks:
+                stack.journal = None
+            journal.close()
+
+    def compile_bundle(self, stack_name=None):
+        """
+        Render the templates of all enabled stacks without deploying them and print them
+        """
+        if self.compile_workers > 1 and not stack_name:
+            self.compile_all()
         for stack in self.stacks:
-            if stack.enabled:
-                stack.create_update_stack()
+            if not stack.enabled or (stack_name and stack.name != stack_name):
+                continue
+            stack.compile()
+            print("# %s (%s)\n%s" % (stack.name, stack.aws_region, stack.cfn_template))
+
+    def compile_all(self, max_workers=None):
+        """
+        Render all enabled stacks whose upstream variables are known in a process pool. The templates are kept
+        by the stacks and used when they compile with the same context, stacks with upstream stacks still to be
+        created or with a changed context are rendered again when they are deployed.
+        :param max_workers: number of worker processes, compile_workers by default
+        :return: map of stack key to (template, seconds) or (None, exception) for the rendered stacks
+        :rtype: dict
+        """
+        jobs = dict()
+        results = dict()
+        # bundles are compiled while other threads poll stacks or compile other targets, a forked worker could
+        # inherit a lock held by one of them, spawned workers start clean
+        with ProcessPoolExecutor(max_workers=max_workers or self.compile_workers,
+                                 mp_context=multiprocessing.get_context('spawn')) as executor:
+            for stack in self.stacks:
+                if not stack.enabled:
+                    continue
+                if not all(dep.variables_available() for dep in stack.depends_on.values()):
+                    self.logger.info("Not rendering %s ahead, upstream stacks do not exist yet" % stack.name)
+                    continue
+                try:
+                    context, _, _ = stack.prepare_context()
+                except Exception as ex:
+                    # e.g. an output the upstream stack only gets when this run deploys it, compile
+                    # resolves it again once the upstream stack is done
+                    self.logger.info("Not rendering %s ahead: %s" % (stack.name, ex))
+                    continue
+                future = executor.submit(render_stack, stack.file, context, stack.template_cache_dir)
+                jobs[future] = (stack, context)
+
+            for future in as_completed(jobs):
+                stack, context = jobs[future]
+                try:
+                    template, seconds = future.result()
+                except Exception as ex:
+                    # compile renders it again and reports the error in the stack operation
+                    self.logger.warning("Rendering %s failed: %s" % (stack.name, ex))
+                    results[stack.key] = (None, ex)
+                    continue
+                stack.set_rendered(context, template, seconds)
+                results[stack.key] = (template, seconds)
+                self.logger.info("Rendered %s in %.2fs" % (stack.name, seconds))
+        return results
 
     def check(self, stack_name=None):
         stack = self.stack_map[stack_name]
@@ -225,39 +387,29 @@ class CFBundle(object):
                                 % stack.cf_stack_name)
             self.cf_desc_stacks = self._describe_all_stacks()
 
-    def delete(self, stack_name=None, force=False):
+    def delete(self, stack_name=None, confirmed=False):
         """
-        Delete all the stacks from CloudFormation.
-        Does this in reverse dependency order.
-        Prompts for confirmation before deleting each stack
+        Delete the enabled stacks from CloudFormation. A stack is deleted as soon as all stacks depending
+        on it are gone, so independent stacks are deleted at the same time.
+        :param confirmed: skip the confirmation prompt
+        :return: map of stack key to (result, status), see StackScheduler.run
         """
-        # Removing stacks so need to do it in reverse dependency order
-        for stack in reversed(self.stacks):
-            if stack_name and stack.name != stack_name:
-                continue
-            self.logger.info("Starting checks for deletion of stack: %s" % stack.name)
-            try:
-                stack_info = stack.get_info()
-                if stack_info is None:
-                    self.logger.info("Stack %s doesn't exist in CloudFormation, skipping" % stack.name)
-                    continue;
-            except:
-                self.logger.info("Failed to check stack in %s CloudFormation, still continue" % stack.name)
-
-
-            confirm = raw_input("Delete stack %s (type 'yes' if so): " % stack.name)
+        stacks = [stack for stack in self.stacks if stack.enabled and (not stack_name or stack.name == stack_name)
+                  and stack.exists()]
+        if not stacks:
+            self.logger.info("No stacks to delete")
+            return dict()
+
+        if not confirmed:
+            print("Stacks to delete: %s" % ", ".join(stack.name for stack in reversed(stacks)))
+            confirm = input("Delete %d stacks (type 'yes' if so): " % len(stacks))
             if not confirm == "yes":
                 self.logger.info("Not confirmed delete, skipping...")
-                continue
-            self.logger.info("Starting delete of stack %s" % stack.name)
-            delete_result = stack.apply(op=CFNStack.OP_DELETE, strict=False, wait=True)
-            if type(delete_result) == StackFailStatus:
-                self.logger.critical("Stack didn't delete correctly, status is now %s" % delete_result)
-                exit(1)
+                return dict()
 
-            # CF told us stack completed ok. Log message to that effect and
-            # refresh the list of stack objects in CF
-            self.logger.info("Finished deleting stack: %s" % stack.name)
+        scheduler = StackScheduler(stacks, max_parallel=self.max_parallel_stacks, on_failure=self.on_failure,
+                                   reverse=True)
+        return scheduler.run(lambda stack: stack.delete_stack())
 
     def merge(self, stack_name=None):
         for stack in self.stacks:
@@ -278,116 +430,165 @@ class CFBundle(object):
 
     def update(self, stack_name=None):
         """
-        Attempts to update each of the stacks if template or parameters are
-        different to what's currently in CloudFormation.
-        If a stack doesn't already exist. Logs critical error and exits.
+        Update the enabled stacks which already exist in CloudFormation, unchanged stacks are skipped.
+        A stack that doesn't exist yet is an error, use create for those.
+        :return: map of stack key to (result, status), see StackScheduler.run
         """
-        for stack in self.stacks:
-            if stack_name and stack.name != stack_name:
-                continue
-            self.logger.info("Starting checks for update of stack: %s"
-                             % stack.name)
-            if not stack.exists_in_cf(self.cf_desc_stacks):
-                self.logger.critical(
-                    "Stack %s doesn't exist in cloudformation, can't update"
-                    " something that doesn't exist." % stack.name)
-                exit(1)
-            if not stack.deps_met(self.cf_desc_stacks):
-                self.logger.critical(
-                    "Dependencies for stack %s not met and they should be,"
-                    " exiting..." % stack.name)
-                exit(1)
-            if not stack.populate_params(self.cf_desc_stacks):
-                self.logger.critical("Could not determine correct parameters"
-                                     " for stack %s" % stack.name)
-                exit(1)
-            stack.read_template()
-            template_up_to_date = stack.template_uptodate(self.cf_desc_stacks)
-            params_up_to_date = stack.params_uptodate(self.cf_desc_stacks)
-            self.logger.debug("Stack is up to date: %s"
-                              % (template_up_to_date and params_up_to_date))
-            if template_up_to_date and params_up_to_date:
-                self.logger.info(
-                    "Stack %s is already up to date with CloudFormation,"
-                    " skipping..." % stack.name)
-            else:
-                if not template_up_to_date:
-                    self.logger.info(
-                        "Template for stack %s has changed." % stack.name)
-                    # Would like to get this working. Tried datadiff but can't
-                    # stop it from printing whole template
-                    # stack.print_template_diff(self.cf_desc_stacks)
-                self.logger.info(
-                    "Starting update of stack %s with parameters: %s"
-                    % (stack.name, stack.get_params_tuples()))
-                self.cfconn.validate_template(
-                    template_body=stack.template_body)
+        stacks = [stack for stack in self.stacks if stack.enabled and (not stack_name or stack.name == stack_name)]
+        missing = [stack.name for stack in stacks if not stack.exists()]
+        if missing:
+            raise Exception("Stacks %s don't exist in cloudformation, can't update something that doesn't exist"
+                            % ", ".join(missing))
 
-                try:
-                    self.cfconn.update_stack(
-                        stack_name=stack.cf_stack_name,
-                        template_body=stack.template_body,
-                        parameters=stack.get_params_tuples(),
-                        capabilities=['CAPABILITY_IAM'],
-                        tags=stack.tags,
-                    )
-                except boto3.exception.BotoServerError as exception:
+        scheduler = StackScheduler(stacks, max_parallel=self.max_parallel_stacks, on_failure=self.on_failure)
+        return self._run_journaled(scheduler, lambda stack: stack.create_update_stack(force=self.force, resume=self.resume))
+
+    def plan(self, stack_name=None):
+        """
+        Render all enabled stacks and compare them with the deployed stacks without changing anything.
+        Deployed stacks are described with one paginated describe_stacks per region, templates are only
+        fetched for stacks whose digest differs from the last deployment by this bundle.
+        :return: list of (stack, state, detail, seconds) in dependency order, state is one of PLAN_STATES
+        :rtype: list
+        """
+        stacks = [stack for stack in self.stacks if stack.enabled and (not stack_name or stack.name == stack_name)]
+
+        start = time.monotonic()
+        deployed = dict()
+        for stack in stacks:
+            if id(stack.cfn_client) not in deployed:
+                deployed[id(stack.cfn_client)] = stack.cfn_client.describe_all_stacks()
+        self.logger.info("Described deployed stacks in %.2fs" % (time.monotonic() - start))
+
+        if self.compile_workers > 1:
+            self.compile_all()
+
+        plan = []
+        for stack in stacks:
+            start = time.monotonic()
+            info = deployed[id(stack.cfn_client)].get(stack.name)
+            try:
+                state, detail = self._plan_stack(stack, info)
+            except Exception as ex:
+                state, detail = PLAN_ERROR, str(ex)
+            plan.append((stack, state, detail, time.monotonic() - start))
+        return plan
+
+    def _plan_stack(self, stack, info):
+        pending = [dep.name for dep in stack.depends_on.values() if not dep.variables_available()]
+        if pending:
+            if info is None:
+                return PLAN_NEW, "after %s" % ", ".join(pending)
+            return PLAN_ERROR, "upstream stacks %s don't exist" % ", ".join(pending)
+
+        stack.compile()
+        if info is None:
+            return PLAN_NEW, ""
+        if stack.is_uptodate(info):
+            return PLAN_UNCHANGED, "same digest as last deployment"
+
+        changed = []
+        if not stack.template_uptodate(info):
+            changed.append("template")
+        if not stack.params_uptodate(info):
+            changed.append("parameters")
+        if changed:
+            return PLAN_CHANGED, ", ".join(changed)
+        return PLAN_UNCHANGED, ""
+
+    @staticmethod
+    def print_plan(plan):
+        """
+        Print one line per stack of a plan and the number of stacks per state
+        """
+        for stack, state, detail, seconds in plan:
+            print("%-10s %-15s %-40s %6.2fs  %s" % (state, stack.aws_region, stack.name, seconds, detail))
+        counts = dict((state, 0) for state in PLAN_STATES)
+        for _, state, _, _ in plan:
+            counts[state] += 1
+        print(", ".join("%d %s" % (counts[state], state) for state in PLAN_STATES))
+
+    def preview(self, stack_name=None):
+        """
+        Preview the changes to all deployed stacks. Change sets are created for all stacks at the same time,
+        one shared loop polls them until CFN has computed them and they are deleted again afterwards.
+        Stacks which don't exist yet or whose upstream stacks don't exist are left out.
+        :return: map of stack key to (status, reason, changes) in dependency order, changes are dicts with
+                 action, logical_id, resource_type, replacement and scope
+        :rtype: dict
+        """
+        stacks = [stack for stack in self.stacks if stack.enabled and (not stack_name or stack.name == stack_name)
+                  and stack.exists() and all(dep.variables_available() for dep in stack.depends_on.values())]
+        if self.compile_workers > 1:
+            self.compile_all()
+
+        change_set_name = "%s-preview-%d" % (self.name, int(time.time()))
+        report = dict()
+        created = dict()
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_parallel_stacks, thread_name_prefix='preview') as executor:
+                futures = dict((executor.submit(stack.create_change_set, change_set_name), stack) for stack in stacks)
+                for future in as_completed(futures):
+                    stack = futures[future]
                     try:
-                        e_message_dict = json.loads(exception[2])
-                        if (str(e_message_dict["Error"]["Message"]) ==
-                           "No updates are to be performed."):
-                            self.logger.error(
-                                "CloudFormation has no updates to perform on"
-                                " %s, this might be because there is a "
-                                "parameter with NoEcho set" % stack.name)
-                            continue
-                        else:
-                            self.logger.error(
-                                "Got error message: %s"
-                                % e_message_dict["Error"]["Message"])
-                            raise exception
-                    except json.decoder.JSONDecodeError:
-                        self.logger.critical(
-                            "Unknown error updating stack: %s", exception)
-                        exit(1)
-                update_result = self.watch_events(
-                    stack.cf_stack_name, [
-                        "UPDATE_IN_PROGRESS",
-                        "UPDATE_COMPLETE_CLEANUP_IN_PROGRESS"])
-                if update_result != "UPDATE_COMPLETE":
-                    self.logger.critical(
-                        "Stack didn't update correctly, status is now %s"
-                        % update_result)
-                    exit(1)
-
-                self.logger.info(
-                    "Finished updating stack: %s" % stack.cf_stack_name)
-
-            # avoid getting rate limited
-            time.sleep(2)
-
-    def create_change_set(self, stack_name=None):
-        """
-        Attempts to update each of the stacks if template or parameters are
-        different to what's currently in CloudFormation.
-        If a stack doesn't already exist. Logs critical error and exits.
+                        if future.result() is not None:
+                            created[stack.key] = stack
+                    except Exception as ex:
+                        self.logger.error("Failed to create change set for %s: %s" % (stack.name, ex))
+                        report[stack.key] = ('FAILED', str(ex), [])
+
+            report.update(self._wait_for_change_sets(created, change_set_name))
+        finally:
+            for stack in created.values():
+                stack.delete_change_set(change_set_name)
+
+        return dict((stack.key, report[stack.key]) for stack in self.stacks if stack.key in report)
+
+    def _wait_for_change_sets(self, stacks, change_set_name):
         """
-        for stack in self.stacks:
-            if stack_name and stack.name != stack_name:
+        Poll the change sets of all stacks in one loop until none of them is pending any more
+        """
+        policy = PollingPolicy.from_config(self.config.get('polling', None))
+        pending = dict(stacks)
+        report = dict()
+        while pending:
+            for key, stack in list(pending.items()):
+                desc = stack.cfn_client.describe_change_set(stack.name, change_set_name)
+                if desc['Status'] in ('CREATE_PENDING', 'CREATE_IN_PROGRESS'):
+                    continue
+                del pending[key]
+                policy.reset()
+                changes = [self._change_summary(change) for change in desc.get('Changes', [])]
+                report[key] = (desc['Status'], desc.get('StatusReason', ''), changes)
+            if pending:
+                time.sleep(policy.delay())
+                policy.idle()
+        return report
+
+    @staticmethod
+    def _change_summary(change):
+        resource = change.get('ResourceChange', {})
+        return {'action': resource.get('Action', ''),
+                'logical_id': resource.get('LogicalResourceId', ''),
+                'resource_type': resource.get('ResourceType', ''),
+                'replacement': resource.get('Replacement', ''),
+                'scope': resource.get('Scope', [])}
+
+    def print_preview(self, report):
+        """
+        Print the changes of a preview, replacements are flagged
+        """
+        for key, (status, reason, changes) in report.items():
+            stack = self.stack_map[key]
+            if status == 'FAILED' and not changes:
+                # CFN fails change sets without changes
+                print("%s: %s" % (stack.name, reason))
                 continue
-            self.logger.info("Getting change set for stack: %s"
-                             % stack.name)
-            #if not stack.exists_in_cf(self.cf_desc_stacks):
-            #    self.logger.critical(
-            #        "Stack %s doesn't exist in cloudformation, can't update"
-            #        " something that doesn't exist." % stack.name)
-            #    exit(1)
-            stack.read_template()
-            changes = stack.create_change_set()
-
-            # avoid getting rate limited
-            time.sleep(2)
-            return changes
+            print("%s: %d changes" % (stack.name, len(changes)))
+            for change in changes:
+                print("  %-8s %-40s %-40s %s" % (change['action'], change['logical_id'], change['resource_type'],
+                                                "REPLACEMENT" if change['replacement'] == 'True' else
+                                                "conditional replacement" if change['replacement'] == 'Conditional' else ""))
 
     def watch(self, stack_name):
         """
@@ -12,9 +12,14 @@
 # language governing permissions and limitations under the License.
 
 import time
+import random
+import threading
 import botocore
 import logging
 from common.awsclient import AWSClient
+from common.awssession import session_key
+from common.ratelimit import is_throttling
+from cfn.cfn_template import template_hash
 
 #boto.set_stream_logger('boto')
 def boto_all(func, *args, **kwargs):
@@ -56,14 +61,32 @@ class CloudformationException(Exception):
     pass
 
 
+def terminal_status(status):
+    """
+    Map a stack status to StackSuccessStatus or StackFailStatus once the stack operation has finished
+    :param status: stack status, None if the stack does not exist
+    :return: final status or None while the operation is in progress
+    """
+    if status is None:
+        return StackUnknownStatus('STACK_GONE')
+    if status.endswith('_FAILED') or status in ('ROLLBACK_COMPLETE', 'UPDATE_ROLLBACK_COMPLETE'):
+        return StackFailStatus(status)
+    if status.endswith('_COMPLETE'):
+        return StackSuccessStatus(status)
+    return None
+
+
 class StackInfo(object):
-    def __init__(self, aws_client, stack_name):
+    def __init__(self, aws_client, stack_name, desc=None):
         self._aws_client = aws_client
         self._stack_name = stack_name
         #self.desc = self._conn.describe_stacks(StackName=stack_name)['Stacks'][0]
-        self.desc = self._aws_client.call('describe_stacks', StackName=stack_name)['Stacks'][0]
+        if desc is None:
+            desc = self._aws_client.call('describe_stacks', StackName=stack_name)['Stacks'][0]
+        self.desc = desc
         self._resources = None
         self._template = None
+        self._template_hash = None
 
     def parameters(self):
         return self.desc.get('Parameters', [])
@@ -83,6 +106,13 @@ class StackInfo(object):
     def statusInProgress(self):
         return self.status().endswith('_IN_PROGRESS')
 
+    def updated_time(self):
+        """
+        Time of the last create or update of the stack as ISO8601 string
+        """
+        updated = self.desc.get('LastUpdatedTime', self.desc.get('CreationTime'))
+        return updated.isoformat() if updated is not None else None
+
     def resources(self):
         if self._resources is None:
             self._resources = self._aws_client.call('list_stack_resources', StackName=self._stack_name, query='StackResourceSummaries')
@@ -94,7 +124,199 @@ class StackInfo(object):
 
         return self._template['TemplateBody']
 
+    def template_hash(self):
+        """
+        Hash of the canonical deployed template, the template is fetched and hashed once per stack info
+        """
+        if self._template_hash is None:
+            self._template_hash = template_hash(self.template())
+        return self._template_hash
+
+
+class PollingPolicy(object):
+    """
+    Adaptive delay between status polls. Polls quickly while stacks change, backs off while they
+    sit on long running resources and backs off harder when the API throttles us.
+    Configured per bundle with the `polling` section of the bundle config.
+    """
+    def __init__(self, min_interval=1, max_interval=30, backoff=1.5, throttle_backoff=3, jitter=0.2):
+        self.min_interval = float(min_interval)
+        self.max_interval = float(max_interval)
+        self.backoff = float(backoff)
+        self.throttle_backoff = float(throttle_backoff)
+        self.jitter = float(jitter)
+        self.interval = self.min_interval
+
+    @staticmethod
+    def from_config(config):
+        """
+        :param config: dict with any of min_interval, max_interval, backoff, throttle_backoff and jitter
+        """
+        return PollingPolicy(**(config or {}))
+
+    def reset(self):
+        """
+        Something changed or a new operation started, poll quickly again
+        """
+        self.interval = self.min_interval
+
+    def idle(self):
+        """
+        Nothing changed since the last poll
+        """
+        self.interval = min(self.interval * self.backoff, self.max_interval)
 
+    def throttled(self):
+        self.interval = min(self.interval * self.throttle_backoff, self.max_interval)
+
+    def delay(self):
+        """
+        :return: seconds to wait before the next poll, jittered so that pollers do not run in lock step
+        """
+        return self.interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+
+class StackPoller(object):
+    """
+    Watches the status of all stacks in flight in a region with one sweep per tick, no matter how many
+    stacks are watched, and wakes up the threads waiting on them after every sweep.
+    A sweep either lists all active stacks or describes the watched ones, whatever needs fewer requests.
+    """
+    # stack summaries per list_stacks page
+    LIST_PAGE_SIZE = 100
+    # failed sweeps in a row after which the waiters of the swept stacks get the error
+    MAX_FAILED_SWEEPS = 5
+
+    def __init__(self, cfn_client, policy=None):
+        self.logger = logging.getLogger(__name__)
+        self._cfn_client = cfn_client
+        self.policy = policy if policy is not None else PollingPolicy()
+        self._cond = threading.Condition()
+        # stack name -> number of watchers
+        self._watched = dict()
+        # stack name -> status seen in the last sweep that looked the stack up, None if the stack does not
+        # exist. Stacks no sweep has looked up yet have no entry.
+        self._status = dict()
+        # stack name -> error of the sweeps that failed to look the stack up since its last status
+        self._errors = dict()
+        self._failed_sweeps = 0
+        self._sweeps = 0
+        self._thread = None
+
+    def watch(self, stack_name):
+        """
+        Start watching a stack, the poller sweeps right away
+        :return: sweep number to pass to the first wait()
+        :rtype: int
+        """
+        with self._cond:
+            self._watched[stack_name] = self._watched.get(stack_name, 0) + 1
+            self.policy.reset()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='poller-%s' % self._cfn_client.region,
+                                                daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+            return self._sweeps
+
+    def unwatch(self, stack_name):
+        with self._cond:
+            count = self._watched.get(stack_name, 0) - 1
+            if count > 0:
+                self._watched[stack_name] = count
+            else:
+                self._watched.pop(stack_name, None)
+                self._status.pop(stack_name, None)
+                self._errors.pop(stack_name, None)
+
+    def wait(self, stack_name, sweep):
+        """
+        Block until a sweep newer than `sweep` completed and the stack has been looked up. A sweep which
+        started before the stack was watched doesn't know the stack, its waiters keep waiting, and so do
+        they after a failed sweep unless the poller gave up on the stack.
+        :return: (sweep, status) status is None if the stack does not exist
+        :rtype: tuple
+        :raises: the error of the last sweep once the poller gave up looking the stack up
+        """
+        with self._cond:
+            while self._sweeps <= sweep or (stack_name not in self._status and stack_name not in self._errors):
+                self._cond.wait()
+            if stack_name in self._errors:
+                raise self._errors[stack_name]
+            return self._sweeps, self._status[stack_name]
+
+    def activity(self):
+        """
+        Report progress seen outside of the status sweep, e.g. new stack events
+        """
+        with self._cond:
+            self.policy.reset()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._watched:
+                    self._thread = None
+                    return
+                stack_names = list(self._watched.keys())
+
+            throttled = False
+            error = None
+            try:
+                statuses = self._sweep(stack_names)
+            except Exception as ex:
+                error = ex
+                throttled = is_throttling(ex)
+                self.logger.warning('Failed to poll stack status in %s: %s' % (self._cfn_client.region, ex))
+                statuses = dict()
+
+            with self._cond:
+                if throttled:
+                    self.policy.throttled()
+                elif any(self._status.get(name, '') != status for name, status in statuses.items()):
+                    self.policy.reset()
+                else:
+                    self.policy.idle()
+
+                if error is None:
+                    self._failed_sweeps = 0
+                else:
+                    self._failed_sweeps += 1
+                    # errors which won't go away by polling again, e.g. access denied or expired credentials,
+                    # and any error that persists fail the waiters instead of blocking them for good
+                    if self._failed_sweeps >= StackPoller.MAX_FAILED_SWEEPS or \
+                            (isinstance(error, botocore.exceptions.ClientError) and not throttled):
+                        for name in stack_names:
+                            self._errors[name] = error
+
+                for name in statuses:
+                    self._errors.pop(name, None)
+                self._status.update(statuses)
+                self._sweeps += 1
+                self._cond.notify_all()
+                # watch() wakes us up early for new stacks, stacks watched while this sweep ran are swept next
+                if error is not None or all(name in self._status for name in self._watched):
+                    self._cond.wait(self.policy.delay())
+
+    def _sweep(self, stack_names):
+        list_requests = self._cfn_client.stack_count() // StackPoller.LIST_PAGE_SIZE + 1
+        if len(stack_names) < list_requests:
+            statuses = dict()
+            for stack_name in stack_names:
+                desc = self._cfn_client.refresh_stack(stack_name)
+                statuses[stack_name] = desc['StackStatus'] if desc else None
+            return statuses
+
+        index = self._cfn_client.load_index()
+        statuses = dict()
+        for stack_name in stack_names:
+            if stack_name in index:
+                statuses[stack_name] = index[stack_name]['StackStatus']
+            else:
+                # a stack created moments ago may not be listed yet
+                desc = self._cfn_client.refresh_stack(stack_name)
+                statuses[stack_name] = desc['StackStatus'] if desc else None
+        return statuses
 
 
 class CFNClient(object):
@@ -106,22 +328,27 @@ class CFNClient(object):
                             'UPDATE_COMPLETE', 'UPDATE_ROLLBACK_IN_PROGRESS', 'UPDATE_ROLLBACK_FAILED',
                             'UPDATE_ROLLBACK_COMPLETE_CLEANUP_IN_PROGRESS', 'UPDATE_ROLLBACK_COMPLETE']
 
-    # connections by region
+    # seconds a scan of all stacks is trusted, stacks changed by this client are refreshed right away
+    STACK_INDEX_TTL = 60
+
+    # connections by session_key
     clients = dict()
 
     @staticmethod
     def get_client(region_stack_name, refresh=False, **kwargs):
         """
         Returns a CFNConnection for a region and cache it locally, optionally you can ask to refresh the cache
+        Clients are cached per session, every account has its own stack index and poller.
         :param region:
         :param refresh:
         :return:
         :rtype: CFNClient
         """
-        cfn_client = CFNClient.clients.get(region_stack_name, None)
+        key = session_key(region_stack_name, **kwargs)
+        cfn_client = CFNClient.clients.get(key, None)
         if refresh or cfn_client is None:
             cfn_client = CFNClient(region_stack_name, **kwargs)
-            CFNClient.clients[region_stack_name] = cfn_client
+            CFNClient.clients[key] = cfn_client
 
         return cfn_client
 
@@ -135,6 +362,15 @@ class CFNClient(object):
         self.aws_client = AWSClient('cloudformation', region_name=region_stack_name, **kwargs)
         # map of StackInfo
         self.info = dict()
+        # stack summaries by name from one scan of all active stacks in the region
+        self.stack_index_ttl = kwargs.get('stack_index_ttl', CFNClient.STACK_INDEX_TTL)
+        self._index = None
+        self._index_time = 0
+        # stacks changed by us since the last scan
+        self._stale = set()
+        self._index_lock = threading.RLock()
+        # shared status poller for all stack waits of this region
+        self.poller = StackPoller(self, PollingPolicy.from_config(kwargs.get('polling', None)))
 
     def get_active_stacks(self):
         # conserve bandwidth (and API calls) by not listing any stacks in DELETE_COMPLETE state
@@ -143,6 +379,12 @@ class CFNClient(object):
         active_stacks = self.aws_client.call("list_stacks", query='StackSummaries', StackStatusFilter=[state for state in CFNClient.VALID_STACK_STATUSES if state != 'DELETE_COMPLETE'])
         return active_stacks
 
+    def iter_active_stacks(self):
+        """
+        Same as get_active_stacks, streaming the stack summaries page by page
+        """
+        return self.aws_client.iter_call("list_stacks", query='StackSummaries', StackStatusFilter=[state for state in CFNClient.VALID_STACK_STATUSES if state != 'DELETE_COMPLETE'])
+
     def stack_exists(self, stack_name):
         """
         Check if a CFN stack exists
@@ -151,24 +393,130 @@ class CFNClient(object):
         :return: True/False
         :rtype: bool
         """
-        active_stacks = self.get_active_stacks()
-        return stack_name in [stack['StackName'] for stack in active_stacks if stack['StackStatus']]
+        return self.get_stack_summary(stack_name) is not None
+
+    def get_stack_summary(self, stack_name):
+        """
+        Look up a stack in the stack index, the index is loaded with one scan of all active stacks and
+        rescanned once older than stack_index_ttl. Stacks changed through this client are described again.
+        :return: stack summary with StackName, StackId and StackStatus or None if the stack does not exist
+        :rtype: dict
+        """
+        with self._index_lock:
+            if self._index is None or time.time() - self._index_time > self.stack_index_ttl:
+                self.load_index()
+
+            if stack_name in self._stale:
+                self.refresh_stack(stack_name)
+
+            return self._index.get(stack_name, None)
+
+    def load_index(self):
+        """
+        Rebuild the stack index with one scan of all active stacks
+        :return: stack summaries by stack name
+        :rtype: dict
+        """
+        index = dict((stack['StackName'], stack) for stack in self.iter_active_stacks())
+        with self._index_lock:
+            self._index = index
+            self._index_time = time.time()
+            self._stale.clear()
+        return index
+
+    def describe_all_stacks(self):
+        """
+        Describe all active stacks with paginated describe_stacks calls instead of one call per stack,
+        the stack index and stack infos are refreshed with the result
+        :return: stack infos by stack name
+        :rtype: dict
+        """
+        infos = dict()
+        for desc in self.aws_client.iter_call('describe_stacks', query='Stacks'):
+            if desc['StackStatus'] != 'DELETE_COMPLETE':
+                infos[desc['StackName']] = StackInfo(self.aws_client, desc['StackName'], desc)
+
+        with self._index_lock:
+            self._index = dict((name, {'StackName': name,
+                                       'StackId': info.desc['StackId'],
+                                       'StackStatus': info.status()}) for name, info in infos.items())
+            self._index_time = time.time()
+            self._stale.clear()
+            self.info = dict(infos)
+        return infos
+
+    def refresh_stack(self, stack_name):
+        """
+        Describe one stack and update the index with it
+        :return: stack description or None if the stack does not exist
+        :rtype: dict
+        """
+        desc = self._describe_stack(stack_name)
+        self._update_index(stack_name, desc)
+        return desc
+
+    def stack_count(self):
+        """
+        Number of active stacks as of the last scan
+        """
+        index = self._index
+        return len(index) if index is not None else 0
+
+    def invalidate(self, stack_name=None):
+        """
+        Mark a stack as changed so that its next lookup describes it again, without stack_name the
+        whole index is dropped
+        """
+        with self._index_lock:
+            if stack_name is None:
+                self._index = None
+            else:
+                self._stale.add(stack_name)
+
+    def _update_index(self, stack_name, desc):
+        with self._index_lock:
+            self._stale.discard(stack_name)
+            if self._index is None:
+                return
+            if desc is None or desc['StackStatus'] == 'DELETE_COMPLETE':
+                self._index.pop(stack_name, None)
+            else:
+                self._index[stack_name] = {'StackName': stack_name,
+                                           'StackId': desc['StackId'],
+                                           'StackStatus': desc['StackStatus']}
+
+    def _describe_stack(self, stack_name):
+        """
+        :return: stack description or None if the stack does not exist
+        """
+        try:
+            return self.aws_client.call('describe_stacks', StackName=stack_name)['Stacks'][0]
+        except botocore.exceptions.ClientError as ex:
+            if 'does not exist' in CFNClient._error_mesg(ex):
+                return None
+            raise
 
     def get_info(self, stack_name, refresh=False):
         """
         Describe CFN stack and return StackInfo
         :param stack_name: stack_name of the stack
         :type stack_name: str
-        :return: stack info object
+        :return: stack info object or None if the stack does not exist
         :rtype: StackInfo
         """
         info = self.info.get(stack_name, None)
         if refresh or info is None:
-            if self.stack_exists(stack_name):
-                info = StackInfo(self.aws_client, stack_name)
+            desc = None
+            # a refresh describes the stack right away instead of checking the index first
+            if refresh or self.stack_exists(stack_name):
+                desc = self.refresh_stack(stack_name)
+
+            if desc is not None and desc['StackStatus'] != 'DELETE_COMPLETE':
+                info = StackInfo(self.aws_client, stack_name, desc)
                 self.info[stack_name] = info
-            elif self.info.get(stack_name, None):
-                del self.info[stack_name]
+            else:
+                info = None
+                self.info.pop(stack_name, None)
         return info
 
     def describe_stack_events(self, stack_name):
@@ -186,9 +534,31 @@ class CFNClient(object):
     def validate(self, template_url):
         return self.aws_client.call('validate_template', TemplateURL=template_url)
 
-    def create_change_set(self, stack_name, template, parameters):
-        params = self._convert_params(parameters)
-        return self.aws_client.call('create_change_set', StackName=stack_name, TemplateBody=template, Parameters=params, Capabilities=['CAPABILITY_IAM', 'CAPABILITY_AUTO_EXPAND'])
+    def create_change_set(self, stack_name, change_set_name, template_url, parameters):
+        """
+        Create a change set updating an existing stack
+        :param template_url: url of the template
+        :type template_url: str
+        :param parameters: dictionary containing key value pairs as CFN parameters
+        :type parameters: dict
+        :return: id of the change set
+        :rtype: str
+        """
+        try:
+            params = self._convert_params(parameters)
+            return self.aws_client.call('create_change_set', query='Id', StackName=stack_name, ChangeSetName=change_set_name,
+                                        ChangeSetType='UPDATE', TemplateURL=template_url, Parameters=params,
+                                        Capabilities=['CAPABILITY_IAM', 'CAPABILITY_AUTO_EXPAND'])
+        except botocore.exceptions.ClientError as ex:
+            raise CloudformationException('Error while creating change set for stack %s: %s' % (stack_name, ex))
+
+    def describe_change_set(self, stack_name, change_set_name):
+        """
+        Describe a change set with the changes of all pages
+        :return: change set description with Status, StatusReason and Changes
+        :rtype: dict
+        """
+        return self.aws_client.call('describe_change_set', StackName=stack_name, ChangeSetName=change_set_name)
 
     def delete_change_set(self, stack_name, change_set_name):
         return self.aws_client.call('delete_change_set', StackName=stack_name, ChangeSetName=change_set_name)
@@ -215,15 +585,15 @@ class CFNClient(object):
         try:
             params = self._convert_params(parameters)
             #self.conn.update_stack(StackName=stack_name, TemplateBody=template, Parameters=params, Capabilities=['CAPABILITY_IAM'])
-            return self.aws_client.call('update_stack', StackName=stack_name, TemplateURL=template_url, Parameters=params, Capabilities=['CAPABILITY_IAM', 'CAPABILITY_AUTO_EXPAND'])
+            resp = self.aws_client.call('update_stack', StackName=stack_name, TemplateURL=template_url, Parameters=params, Capabilities=['CAPABILITY_IAM', 'CAPABILITY_AUTO_EXPAND'])
+            self.invalidate(stack_name)
+            return resp
         except botocore.exceptions.ClientError as ex:
             if CFNClient._error_mesg(ex) == 'No updates are to be performed.':
                 # this is not really an error, but there aren't any updates.
                 return False
             else:
-                raise CloudformationException('Error while updating stack %s: %s' % (stack_name, ex.message))
-        else:
-            return True
+                raise CloudformationException('Error while updating stack %s: %s' % (stack_name, ex))
 
     def create_stack(self, stack_name, template_url, parameters):
         """
@@ -240,7 +610,9 @@ class CFNClient(object):
             params = self._convert_params(parameters)
 
             #self.conn.create_stack(StackName=stack_name, TemplateBody=template, DisableRollback=True,Parameters=params, Capabilities=['CAPABILITY_IAM'])
-            return self.aws_client.call('create_stack', StackName=stack_name, TemplateURL=template_url, DisableRollback=True, Parameters=params, Capabilities=['CAPABILITY_IAM', 'CAPABILITY_AUTO_EXPAND'])
+            resp = self.aws_client.call('create_stack', StackName=stack_name, TemplateURL=template_url, DisableRollback=True, Parameters=params, Capabilities=['CAPABILITY_IAM', 'CAPABILITY_AUTO_EXPAND'])
+            self.invalidate(stack_name)
+            return resp
         except botocore.exceptions.ClientError as ex:
             raise CloudformationException('Error while creating stack %s: %s' % (stack_name, ex))
 
@@ -257,10 +629,30 @@ class CFNClient(object):
 
         try:
             #self.conn.delete_stack(StackName=stack_name)
-            return self.aws_client.call('delete_stack', StackName=stack_name)
+            resp = self.aws_client.call('delete_stack', StackName=stack_name)
+            self.invalidate(stack_name)
+            return resp
         except botocore.exceptions.ClientError as ex:
             raise CloudformationException('Error while deleting stack %s: %s' % (stack_name, ex))
 
+    def stack_events_since(self, stack_name, last_event_id=None):
+        """
+        Stack events newer than last_event_id, oldest first. Events are listed newest first, so only the
+        pages up to the last seen event are requested no matter how long the history of the stack is.
+        :param stack_name: stack stack_name
+        :type stack_name: str
+        :param last_event_id: EventId of the newest event already seen, None for all events
+        :type last_event_id: str
+        :return: stack events
+        :rtype: list of dict
+        """
+        events = []
+        for event in self.aws_client.iter_call('describe_stack_events', query='StackEvents', StackName=stack_name):
+            if event['EventId'] == last_event_id:
+                break
+            events.append(event)
+        return events[::-1]
+
     def tail_stack_events(self, stack_name, initial_entry=None):
         """
         This function is a wrapper around _tail_stack_events(), because a generator function doesn't run any code
@@ -276,78 +668,85 @@ class CFNClient(object):
         process, for loop through the iterator receiving the generated events and status updates.
         :param stack_name: stack stack_name
         :type stack_name: str
-        :param initial_entry: where to start tailing from. None means to start from the last item (exclusive)
+        :param initial_entry: where to start tailing from. None means to start from the last item (exclusive),
+                              negative values include that many of the latest events, positive values skip
+                              that many of the oldest events
         :type initial_entry: None or int
         :return: generator object yielding stack events
         :rtype: generator
         """
         try:
-            if initial_entry is None:
-                return self._tail_stack_events(stack_name, len(self.describe_stack_events(stack_name)))
-            elif initial_entry < 0:
-                return self._tail_stack_events(stack_name, len(self.describe_stack_events(stack_name)) + initial_entry)
-            else:
-                return self._tail_stack_events(stack_name, initial_entry)
+            return self._tail_stack_events(stack_name, self._event_cursor(stack_name, initial_entry))
         except botocore.exceptions.ClientError as ex:
             self.logger.error('Failed to describe stack %s, Reason: %s ' % (stack_name, ex))
 
-    def _tail_stack_events(self, stack_name, initial_entry):
+    def _event_cursor(self, stack_name, initial_entry):
+        """
+        EventId of the newest event not to be reported by _tail_stack_events, None to report all events
+        """
+        if initial_entry == 0:
+            return None
+
+        if initial_entry is None or initial_entry < 0:
+            # newest first, skip the latest -initial_entry events
+            skip = 0 if initial_entry is None else -initial_entry
+            seen = 0
+            for event in self.aws_client.iter_call('describe_stack_events', query='StackEvents', StackName=stack_name):
+                if seen == skip:
+                    return event['EventId']
+                seen += 1
+            return None
+
+        # counting from the oldest event needs the whole history, but only once
+        events = self.describe_stack_events(stack_name)
+        if len(events) == 0:
+            return None
+        return events[max(len(events) - initial_entry, 0)]['EventId']
+
+    def _tail_stack_events(self, stack_name, last_event_id):
         """
         See tail_stack_events()
         """
-
-        previous_stack_events = initial_entry
-
-        while True:
-            try:
-                stack_info = self.get_info(stack_name, refresh=True)
-
-                if stack_info.statusInProgress():
-                    stack_events = self.describe_stack_events(stack_name)
-
-                    if len(stack_events) > previous_stack_events:
-                        # iterate on all new events, at reversed order (the list is sorted from newest to oldest)
-                        for event in stack_events[:-previous_stack_events or None][::-1]:
-                            yield {'resource_type': event.get('ResourceType',''),
-                                   'logical_resource_id': event.get('LogicalResourceId',''),
-                                   'physical_resource_id': event.get('PhysicalResourceId',''),
-                                   'resource_status': event.get('ResourceStatus',''),
-                                   'resource_status_reason': event.get('ResourceStatusReason', ''),
-                                   'timestamp': event['Timestamp']}
-
-                        previous_stack_events = len(stack_events)
-
-                if stack_info.status().endswith('_FAILED') or \
-                        stack_info.status() in ('ROLLBACK_COMPLETE', 'UPDATE_ROLLBACK_COMPLETE'):
-                    yield StackFailStatus(stack_info.status())
-                    break
-                elif stack_info.status().endswith('_COMPLETE'):
-                    yield StackSuccessStatus(stack_info.status())
+        sweep = self.poller.watch(stack_name)
+        try:
+            while True:
+                # raises once the status can't be polled, an error reading the events ends the tail below
+                sweep, status = self.poller.wait(stack_name, sweep)
+                try:
+                    # report the events first, so that the final events are seen before the status
+                    events = self.stack_events_since(stack_name, last_event_id)
+                    if events:
+                        self.poller.activity()
+                    for event in events:
+                        yield {'resource_type': event.get('ResourceType',''),
+                               'logical_resource_id': event.get('LogicalResourceId',''),
+                               'physical_resource_id': event.get('PhysicalResourceId',''),
+                               'resource_status': event.get('ResourceStatus',''),
+                               'resource_status_reason': event.get('ResourceStatusReason', ''),
+                               'timestamp': event['Timestamp']}
+                        last_event_id = event['EventId']
+                except botocore.exceptions.ClientError as ex:
+                    #if CFNConnection._error_code(ex) == 400 and str(CFNConnection._error_mesg(ex)) == "Stack [%s] does not exist" % stack_name:
+                    status = None
+
+                final_status = terminal_status(status)
+                if final_status is not None:
+                    yield final_status
                     break
-            except botocore.exceptions.ClientError as ex:
-                #if CFNConnection._error_code(ex) == 400 and str(CFNConnection._error_mesg(ex)) == "Stack [%s] does not exist" % stack_name:
-                yield StackUnknownStatus('STACK_GONE')
-                break;
-            # avoid rate limited
-            time.sleep(2)
+        finally:
+            self.poller.unwatch(stack_name)
 
     def wait_for_status(self, stack_name):
-        while True:
-            try:
-                stack_info = self.get_info(stack_name, refresh=True)
-                if stack_info.statusInProgress():
-                    self.logger.debug('waiting: operation inprogress stack: %s ' % stack_name)
-                else:
-                    if stack_info.status().endswith('_COMPLETE'):
-                        return StackSuccessStatus(stack_info.status())
-                    else:
-                        return StackFailStatus(stack_info.status())
-            except botocore.exceptions.ClientError as ex:
-                return StackUnknownStatus('STACK_GONE')
-                break;
-
-            time.sleep(2)
-
+        sweep = self.poller.watch(stack_name)
+        try:
+            while True:
+                sweep, status = self.poller.wait(stack_name, sweep)
+                final_status = terminal_status(status)
+                if final_status is not None:
+                    return final_status
+                self.logger.debug('waiting: operation inprogress stack: %s ' % stack_name)
+        finally:
+            self.poller.unwatch(stack_name)
 
     def _convert_params(self, parameters):
         params = []
@@ -0,0 +1,170 @@
+# Copyright Prakash Sidaraddi.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+"""
+Deployment of one bundle to several targets at the same time.
+A bundle listing aws_regions and/or aws_accounts in its config is loaded once per account and region,
+each copy runs its own stack scheduler with its own clients, poller and rate limits, and the results
+are reported together. Accounts are reached by assuming a role, e.g.
+
+    aws_accounts:
+      prod: arn:aws:iam::111111111111:role/Deployer
+      test:
+        role_arn: arn:aws:iam::222222222222:role/Deployer
+        external_id: secret
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from cfn.cfn_bundle import CFBundle
+from cfn.cfn_scheduler import StackScheduler
+
+logger = logging.getLogger(__name__)
+
+
+def load_bundle(yaml_file, **kwargs):
+    """
+    Load a bundle file, as FanoutBundle if it lists aws_regions or aws_accounts
+    :rtype: CFBundle or FanoutBundle
+    """
+    config = CFBundle.read_input(yaml_file).get('config', {})
+    regions = config.get('aws_regions', None)
+    accounts = config.get('aws_accounts', None)
+    if not regions and not accounts:
+        return CFBundle(yaml_file, **kwargs)
+
+    targets = dict()
+    for account_name, account in (accounts or {None: None}).items():
+        account_kwargs = account_target(account_name, account)
+        for region in (regions or [None]):
+            label = "/".join(part for part in (account_name, region) if part)
+            targets[label] = dict(account_kwargs, target_region=region)
+    return FanoutBundle(yaml_file, targets, max_parallel_targets=config.get('max_parallel_targets', None), **kwargs)
+
+
+def account_target(account_name, account):
+    """
+    CFBundle arguments for an entry of aws_accounts
+    :param account: role arn or dict with role_arn and optionally external_id and role_session_name
+    :rtype: dict
+    """
+    if account_name is None:
+        return dict()
+    if isinstance(account, str):
+        account = {'role_arn': account}
+    if not isinstance(account, dict) or 'role_arn' not in account:
+        raise Exception("Account %s needs a role_arn to deploy with" % account_name)
+
+    target = dict(account, target_account=account_name)
+    # arn:aws:iam::<account id>:role/<name>
+    target['aws_account'] = account.get('aws_account', account['role_arn'].split(':')[4])
+    return target
+
+
+class FanoutBundle(object):
+    """
+    A bundle deployed to several accounts and regions, offers the commands of CFBundle over all of them
+    """
+
+    def __init__(self, yaml_file, targets, max_parallel_targets=None, **kwargs):
+        """
+        :param targets: map of target name to CFBundle arguments of the target, the bundle is compiled for each
+        :param max_parallel_targets: number of targets deployed at the same time, all by default
+        """
+        self.bundles = dict()
+        for target, target_kwargs in targets.items():
+            self.bundles[target] = CFBundle(yaml_file, **dict(kwargs, **target_kwargs))
+        self.max_parallel_targets = int(max_parallel_targets or len(self.bundles))
+
+    def run(self, operation):
+        """
+        Run operation(bundle) for all targets at the same time
+        :return: map of target to the result of the operation or the exception it raised
+        :rtype: dict
+        """
+        results = dict()
+        with ThreadPoolExecutor(max_workers=self.max_parallel_targets, thread_name_prefix='target') as executor:
+            futures = dict((target, executor.submit(operation, bundle)) for target, bundle in self.bundles.items())
+            for target, future in futures.items():
+                try:
+                    results[target] = future.result()
+                except Exception as ex:
+                    logger.error("[%s] failed: %s" % (target, ex))
+                    results[target] = ex
+        return results
+
+    def _run_stacks(self, operation):
+        """
+        Run a stack scheduling operation for all targets and report all of them
+        :return: map of (target, stack key) to (result, status), see StackScheduler.run
+        """
+        results = dict()
+        for target, target_results in self.run(operation).items():
+            if isinstance(target_results, Exception):
+                results[(target, None)] = (StackScheduler.FAILED, target_results)
+                continue
+            for key, result in target_results.items():
+                results[(target, key)] = result
+        self.print_results(results)
+        return results
+
+    def print_results(self, results):
+        """
+        Print one line per stack and target and the number of stacks per result
+        """
+        counts = dict()
+        for (target, key), (result, status) in sorted(results.items(), key=lambda item: (item[0][0], str(item[0][1]))):
+            name = self.bundles[target].stack_map[key].name if key is not None else '-'
+            print("%-25s %-10s %-40s %s" % (target, result, name, status if status is not None else ''))
+            counts[result] = counts.get(result, 0) + 1
+        print(", ".join("%d %s" % (count, result) for result, count in sorted(counts.items())))
+
+    def create_update_bundle(self):
+        return self._run_stacks(lambda bundle: bundle.create_update_bundle())
+
+    def update(self, stack_name=None):
+        return self._run_stacks(lambda bundle: bundle.update(stack_name))
+
+    def delete(self, stack_name=None, confirmed=False):
+        if not confirmed:
+            confirm = input("Delete the bundle in %s (type 'yes' if so): " % ", ".join(self.bundles))
+            if not confirm == "yes":
+                logger.info("Not confirmed delete, skipping...")
+                return dict()
+        return self._run_stacks(lambda bundle: bundle.delete(stack_name, confirmed=True))
+
+    def compile_bundle(self, stack_name=None):
+        for target, result in self.run(lambda bundle: bundle.compile_bundle(stack_name)).items():
+            if isinstance(result, Exception):
+                raise result
+
+    def plan(self, stack_name=None):
+        plan = []
+        for target, target_plan in self.run(lambda bundle: bundle.plan(stack_name)).items():
+            if isinstance(target_plan, Exception):
+                raise target_plan
+            plan.extend(target_plan)
+        return plan
+
+    def print_plan(self, plan):
+        CFBundle.print_plan(plan)
+
+    def preview(self, stack_name=None):
+        return self.run(lambda bundle: bundle.preview(stack_name))
+
+    def print_preview(self, report):
+        for target, target_report in report.items():
+            print("== %s" % target)
+            if isinstance(target_report, Exception):
+                print("preview failed: %s" % target_report)
+                continue
+            self.bundles[target].print_preview(target_report)
@@ -0,0 +1,88 @@
+# Copyright Prakash Sidaraddi.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+"""
+Write ahead journal of a bundle deployment. Every phase a stack goes through is appended to the journal
+and synced to disk before the next step starts, so a run that died can be resumed where it stopped.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# phases of a stack, in order
+COMPILED = 'compiled'
+UPLOADED = 'uploaded'
+SUBMITTED = 'submitted'
+COMPLETED = 'completed'
+FAILED = 'failed'
+
+
+class DeployJournal(object):
+    """
+    Append only journal with one json record per line: time, stack, phase and phase details like
+    digest, template url, stack id or status
+    """
+
+    def __init__(self, path, resume=False):
+        """
+        :param path: journal file
+        :param resume: continue the journal of the previous run instead of starting a new one
+        """
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        # last record of each stack
+        self.stacks = dict()
+
+        if resume:
+            self._load()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(str(self.path), 'a' if resume else 'w')
+
+    def _load(self):
+        if not self.path.is_file():
+            logger.warning("No journal %s to resume from, deploying all stacks" % self.path)
+            return
+        with open(str(self.path), 'r') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # the last line of a run that died while writing it
+                    logger.warning("Ignoring incomplete journal record %s" % line.strip())
+                    continue
+                self.stacks[record['stack']] = record
+
+    def last(self, stack_name):
+        """
+        :return: last record of the stack or None
+        :rtype: dict
+        """
+        with self._lock:
+            return self.stacks.get(stack_name, None)
+
+    def record(self, stack_name, phase, **details):
+        record = dict(details, time=time.time(), stack=stack_name, phase=phase)
+        line = json.dumps(record, sort_keys=True, default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self.stacks[stack_name] = record
+
+    def close(self):
+        with self._lock:
+            self._file.close()
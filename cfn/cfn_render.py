@@ -0,0 +1,131 @@
+# Copyright Prakash Sidaraddi.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+"""
+Jinja rendering of stack templates.
+A stack template file holds up to three yaml documents, the optional config document is rendered into
+extra context for the template document. Jinja environments are cached per search path and templates
+are compiled once per file and reloaded when the file changes, optionally with a bytecode cache on disk.
+Compiled templates are shared, so per stack globals like `context` are passed with each render.
+"""
+import os
+import re
+import threading
+from pathlib import Path
+
+import jinja2
+from jinja2.runtime import new_context
+
+JINJA_EXTENSIONS = ['jinja2_ansible_filters.AnsibleCoreFiltersExtension']
+
+CONFIG_SECTION = 'config'
+TEMPLATE_SECTION = 'template'
+
+
+def split_template(text):
+    """
+    Split a stack template file into its config and template documents
+    :return: (raw_config, raw_template)
+    :rtype: tuple
+    """
+    docs = re.split(r'[\r\n\s]*---[\r\n]+', text)
+    raw_template = ""
+    raw_config = ""
+
+    if len(docs) == 1:
+        raw_template = docs[0]
+    elif len(docs) == 2:
+        raw_template = docs[1]
+    elif len(docs) == 3:
+        raw_config = docs[1]
+        raw_template = docs[2]
+
+    return (raw_config, raw_template)
+
+
+class StackTemplateLoader(jinja2.FileSystemLoader):
+    """
+    FileSystemLoader which also loads the documents of a stack template file,
+    '<absolute path>#config' and '<absolute path>#template' name the two documents.
+    Templates are reloaded by the environment once the file modification time changes.
+    """
+
+    def get_source(self, environment, template):
+        path, sep, section = template.rpartition('#')
+        if not sep or section not in (CONFIG_SECTION, TEMPLATE_SECTION):
+            return super(StackTemplateLoader, self).get_source(environment, template)
+
+        if not os.path.isfile(path):
+            raise jinja2.TemplateNotFound(template)
+        mtime = os.path.getmtime(path)
+        with open(path, 'r') as f:
+            raw_config, raw_template = split_template(f.read())
+
+        source = raw_config if section == CONFIG_SECTION else raw_template
+        return source, path, lambda: os.path.isfile(path) and os.path.getmtime(path) == mtime
+
+
+# jinja environments by (search path, bytecode cache directory)
+environments = dict()
+environments_lock = threading.Lock()
+
+
+def get_environment(search_path, cache_dir=None):
+    """
+    Jinja environment for templates in search_path, shared by all stacks of the process
+    :param search_path: directory includes and imports are resolved from
+    :param cache_dir: optional directory for compiled template bytecode, reused across runs
+    :rtype: jinja2.Environment
+    """
+    key = (str(search_path), str(cache_dir) if cache_dir else None)
+    with environments_lock:
+        jinja_env = environments.get(key)
+        if jinja_env is None:
+            bytecode_cache = None
+            if cache_dir:
+                Path(cache_dir).mkdir(parents=True, exist_ok=True)
+                bytecode_cache = jinja2.FileSystemBytecodeCache(str(cache_dir))
+            jinja_env = jinja2.Environment(loader=StackTemplateLoader(str(search_path)),
+                                           extensions=JINJA_EXTENSIONS,
+                                           bytecode_cache=bytecode_cache,
+                                           auto_reload=True)
+            environments[key] = jinja_env
+    return jinja_env
+
+
+def get_template(path, section, cache_dir=None):
+    """
+    Compiled config or template document of a stack template file
+    :param path: stack template file
+    :param section: CONFIG_SECTION or TEMPLATE_SECTION
+    :rtype: jinja2.Template
+    """
+    path = Path(path).resolve()
+    return get_environment(path.parent, cache_dir).get_template("%s#%s" % (path, section))
+
+
+def render_template(template, variables, template_globals):
+    """
+    Render a shared compiled template with extra globals for this render only. Unlike render variables,
+    globals are also visible in macro files imported without `with context`, as template.globals are,
+    but the shared template is left untouched so concurrent renders don't see each other's globals.
+    :param template: compiled template returned by get_template
+    :param variables: render variables
+    :param template_globals: globals of this render
+    :rtype: str
+    """
+    ctx = new_context(template.environment, template.name, template.blocks, variables, shared=False,
+                      globals=dict(template.globals, **template_globals))
+    try:
+        return template.environment.concat(template.root_render_func(ctx))
+    except Exception:
+        template.environment.handle_exception()
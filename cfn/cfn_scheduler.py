@@ -0,0 +1,160 @@
+# Copyright Prakash Sidaraddi.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+"""
+Scheduler running stack operations of a bundle over its dependency graph.
+Every stack whose dependencies are satisfied is started right away, so the
+wall clock time of a bundle run is bound by its critical path instead of the
+sum of all stacks.
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from cfn.cfn_client import StackFailStatus, StackUnknownStatus
+
+logger = logging.getLogger(__name__)
+
+
+class StackScheduler(object):
+    # failure policies
+    FAIL_FAST = 'fail_fast'
+    CONTINUE = 'continue'
+
+    # per stack results
+    SUCCEEDED = 'SUCCEEDED'
+    FAILED = 'FAILED'
+    CANCELLED = 'CANCELLED'
+
+    def __init__(self, stacks, max_parallel=4, on_failure=FAIL_FAST, reverse=False):
+        """
+        :param stacks: stacks to schedule, dependencies outside of this list are treated as satisfied
+        :type stacks: list of CFNStack
+        :param max_parallel: maximum number of stack operations running at the same time
+        :type max_parallel: int
+        :param on_failure: FAIL_FAST to stop starting new stacks after the first failure,
+                           CONTINUE to keep going with stacks that do not depend on the failed one
+        :type on_failure: str
+        :param reverse: run stacks after the stacks depending on them instead, e.g. to delete stacks
+        :type reverse: bool
+        """
+        if on_failure not in (StackScheduler.FAIL_FAST, StackScheduler.CONTINUE):
+            raise ValueError("Unknown failure policy %s" % on_failure)
+        if max_parallel < 1:
+            raise ValueError("max_parallel must be at least 1 not %s" % max_parallel)
+
+        self.stacks = list(stacks)
+        self.max_parallel = max_parallel
+        self.on_failure = on_failure
+
+        self.stack_map = dict((stack.key, stack) for stack in self.stacks)
+        # key -> keys of the stacks it has to wait for
+        self.dependencies = dict((key, set()) for key in self.stack_map)
+        # key -> keys of the stacks waiting for it
+        self.dependents = dict((key, []) for key in self.stack_map)
+        for stack in self.stacks:
+            for dep_key in stack.depends_on:
+                if dep_key not in self.stack_map:
+                    continue
+                first, then = (stack.key, dep_key) if reverse else (dep_key, stack.key)
+                self.dependencies[then].add(first)
+                self.dependents[first].append(then)
+
+    def run(self, operation):
+        """
+        Run operation(stack) for every stack, starting each stack as soon as all its dependencies succeeded.
+        A stack fails when operation raises or returns a StackFailStatus/StackUnknownStatus, its
+        descendants are then cancelled without being started.
+        :param operation: callable receiving the stack
+        :return: map of stack key to (result, status or exception)
+        :rtype: dict
+        """
+        results = dict()
+        waiting = dict((key, len(deps)) for key, deps in self.dependencies.items())
+        ready = [stack.key for stack in self.stacks if waiting[stack.key] == 0]
+        running = dict()
+        stop = False
+
+        with ThreadPoolExecutor(max_workers=self.max_parallel, thread_name_prefix='stack') as executor:
+            try:
+                while ready or running:
+                    while ready and not stop and len(running) < self.max_parallel:
+                        key = ready.pop(0)
+                        logger.info("Starting stack %s" % self.stack_map[key].name)
+                        running[executor.submit(operation, self.stack_map[key])] = key
+
+                    if not running:
+                        break
+
+                    done, _ = wait(running.keys(), return_when=FIRST_COMPLETED)
+                    for future in done:
+                        key = running.pop(future)
+                        result = self._result(key, future)
+                        results[key] = result
+
+                        if result[0] == StackScheduler.SUCCEEDED:
+                            for dep_key in self.dependents[key]:
+                                waiting[dep_key] -= 1
+                                if waiting[dep_key] == 0 and dep_key not in results:
+                                    ready.append(dep_key)
+                        else:
+                            self._cancel_descendants(key, results)
+                            if self.on_failure == StackScheduler.FAIL_FAST:
+                                stop = True
+            except BaseException:
+                # Ctrl-C or scheduler bug, don't start anything new and leave the running ones to finish
+                for future in running:
+                    future.cancel()
+                raise
+
+        for key in self.stack_map:
+            if key not in results:
+                results[key] = (StackScheduler.CANCELLED, None)
+
+        self._log_summary(results)
+        return results
+
+    def _result(self, key, future):
+        name = self.stack_map[key].name
+        try:
+            status = future.result()
+        except Exception as ex:
+            logger.error("Stack %s failed: %s" % (name, ex))
+            return (StackScheduler.FAILED, ex)
+
+        if isinstance(status, (StackFailStatus, StackUnknownStatus)):
+            logger.error("Stack %s failed with status %s" % (name, status))
+            return (StackScheduler.FAILED, status)
+
+        logger.info("Stack %s finished" % name)
+        return (StackScheduler.SUCCEEDED, status)
+
+    def _cancel_descendants(self, key, results):
+        pending = list(self.dependents[key])
+        while pending:
+            dep_key = pending.pop()
+            if dep_key in results:
+                continue
+            logger.warning("Cancelling stack %s, dependency %s failed" % (self.stack_map[dep_key].name,
+                                                                         self.stack_map[key].name))
+            results[dep_key] = (StackScheduler.CANCELLED, None)
+            pending.extend(self.dependents[dep_key])
+
+    def _log_summary(self, results):
+        for stack in self.stacks:
+            result, status = results[stack.key]
+            logger.info("%-10s %s %s" % (result, stack.name, status if status is not None else ''))
+
+    @staticmethod
+    def failed(results):
+        """
+        :return: True if any stack in the results failed or was cancelled
+        """
+        return any(result != StackScheduler.SUCCEEDED for result, _ in results.values())
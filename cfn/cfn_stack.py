@@ -13,17 +13,130 @@
 """
 CFNStack represents one independent cloud formation stack
 """
+import copy
 import logging
+import hashlib
+import threading
+import time
 import json, yaml
-import jmespath
-from cfn.cfn_client import CFNClient, StackSuccessStatus, StackFailStatus, StackUnknownStatus
+from common.jmespathhelper import compile_expression
+from cfn.cfn_client import CFNClient, StackSuccessStatus, StackFailStatus, StackUnknownStatus, terminal_status
+from cfn.stack_states import COMPLETE_STACK_STATES
 from pathlib import Path
-import jinja2
+from cfn import cfn_render
+from cfn.cfn_template import template_hash
+from cfn import cfn_journal
 from common.langhelper import importFromURI as importPythonFile
-from common.s3bucket import  put_template as put_template_to_s3
 
 logger = logging.getLogger(__name__)
 
+# template urls are content addressed, a url validated once stays valid
+validated_urls = set()
+validated_urls_lock = threading.Lock()
+
+# plugins loaded by render_stack in worker processes, by template file
+worker_plugins = dict()
+
+
+def render_stack(file, context, cache_dir=None):
+    """
+    Render a stack template outside of its stack, e.g. in a worker process of CFBundle.compile_all
+    :param file: stack template file, its plugin is loaded once per process
+    :param context: context returned by CFNStackData.prepare_context
+    :return: (rendered template, seconds spent rendering)
+    :rtype: tuple
+    """
+    file = str(file)
+    if file not in worker_plugins:
+        worker_plugins[file] = importPythonFile(file, True)
+    return _render_stack(file, context, cache_dir, worker_plugins[file], Path(file).stem)
+
+
+def _render_stack(file, context, cache_dir, plugin, key):
+    start = time.monotonic()
+    # render config from tempalte, compiled templates are shared so context is a global of this render only
+    template = cfn_render.get_template(file, cfn_render.CONFIG_SECTION, cache_dir)
+    config_string = cfn_render.render_template(template, context, {'context': context})
+    if len(config_string.strip()) > 0:
+      local_config = yaml.safe_load(config_string)
+      local_config = resolve_references(local_config, context)
+      template_context = local_config | context
+    else:
+      template_context = context
+
+    if plugin and hasattr(plugin, 'prepare_context'):
+        template_context = plugin.prepare_context(template_context)
+        if template_context is None:
+            logger.warning("You may have forgotten to return context in plugin " + key + ".py")
+
+    template_actual = cfn_render.get_template(file, cfn_render.TEMPLATE_SECTION, cache_dir)
+    cfn_template = cfn_render.render_template(template_actual, template_context, {'context': template_context})
+    return cfn_template, time.monotonic() - start
+
+
+def resolve_references(item, context):
+    if type(item) is str:
+        return resolve_reference(item, context) if item.startswith("$") and not item.startswith("$$") else item
+    elif type(item) is dict:
+        for key, value in item.items():
+            item[key] = resolve_references(value, context)
+        return item
+    elif type(item) is list:
+        new_list = []
+        for list_item in item:
+            new_list.append(resolve_references(list_item, context))
+        return new_list
+    else:
+        try:
+            new_items = []
+            for sub_item in item:
+                new_items.append(resolve_references(sub_item, context))
+            return new_items
+        except TypeError:
+            return item
+
+
+def resolve_reference(attr, context):
+    '''
+
+    :param attr:    config.variable
+                    parameters.variable
+                    tags.variable
+                    stack_name.outputs.variable
+                    stack_name.resources.variable
+                    stack_name.parameters.variable
+
+    :return:
+    '''
+    if attr.startswith("$"):
+        attr = attr[1:]
+
+    splits = attr.split('.')
+    base = splits[0]
+    # case of nested variables
+    env = context.get(base, None)
+    if env is None:
+        raise Exception('Can not find context %s to resolve %s' % (base, attr))
+
+    query = attr[attr.index(".") + 1:]
+    query = compile_expression(query)
+    data = query.search(env)
+
+    if data is not None:
+        return data
+
+    # TODO: try without qualified name
+
+    raise Exception('Failed to resolve variable %s ' % attr)
+
+
+def _param_value(value):
+    # list parameters are passed to CFN comma separated
+    if isinstance(value, list):
+        return ",".join(str(item) for item in value)
+    return str(value)
+
+
 class CFNStack(object):
     def __init__(self, key, name, aws_region, enabled:bool=False, **kwargs):
         self.key = key
@@ -33,6 +146,9 @@ class CFNStack(object):
         self.depends_on = {}
         self.kwargs = kwargs
         self.cfn_vars = {}
+        self._cfn_vars_lock = threading.Lock()
+        # StackOutputsStore set by the bundle, shares variables between all stacks of a bundle run
+        self.outputs_store = None
         self.enabled = enabled
         if len(key) <= 0 or len(name) <=0 or len(aws_region) <= 0:
             logger.critical("Stack key, name and aws_region are required fields.")
@@ -46,6 +162,23 @@ class CFNStack(object):
     def exists(self):
         return self.cfn_client.stack_exists(self.name)
 
+    def variables_available(self):
+        """
+        Check if the variables of this stack can be used, without an API call when the outputs store has them
+        """
+        if self.outputs_store is not None and self.outputs_store.has(self.name):
+            return True
+        return self.exists()
+
+    def invalidate_variables(self):
+        """
+        Drop the cached variables after the stack changed
+        """
+        with self._cfn_vars_lock:
+            self.cfn_vars = {}
+        if self.outputs_store is not None:
+            self.outputs_store.invalidate(self.name)
+
     def get_cf_variables(self, refresh=False):
         """
         Get a variable from a existing cloudformation stack, var_type should be
@@ -53,9 +186,18 @@ class CFNStack(object):
         If using inventory, provide the logical ID and this will return the
         Physical ID
         """
-        if len(self.cfn_vars) > 0 and not refresh:
-            return self.cfn_vars
-
+        if self.outputs_store is not None:
+            if refresh:
+                self.outputs_store.invalidate(self.name)
+            return self.outputs_store.get(self.name, lambda: self._fetch_cf_variables(refresh))
+
+        with self._cfn_vars_lock:
+            # dependents compiling at the same time share one fetch
+            if len(self.cfn_vars) > 0 and not refresh:
+                return self.cfn_vars
+            return self._fetch_cf_variables(refresh)
+
+    def _fetch_cf_variables(self, refresh):
         info = self.cfn_client.get_info(self.name, refresh)
         parameters = dict()
         outputs = dict()
@@ -112,6 +254,25 @@ class CFNStackData(CFNStack):
             raise Exception('Can not read file %s' % str(self.file))
 
         self.sns_topic_arn = sns_topic_arn
+        # optional directory for jinja bytecode of compiled templates
+        self.template_cache_dir = kwargs.get('template_cache_dir', None)
+
+        # StackDigestStore set by the bundle, without it stacks are always deployed
+        self.digest_store = None
+        # TemplateBucket set by the bundle
+        self.template_bucket = None
+        # DeployJournal set by the bundle
+        self.journal = None
+        self.digest = None
+        # parameters and tags of the last compile with references resolved, config, params and tags keep the
+        # references so that every compile resolves them against the current upstream variables
+        self.resolved_params = None
+        self.resolved_tags = None
+        # (context fingerprint, template) rendered by CFBundle.compile_all
+        self.rendered = None
+        self.render_seconds = None
+        # (template, hash) of the last compiled template
+        self._template_hash = None
 
         #self.validate(**kwargs)
 
@@ -120,70 +281,103 @@ class CFNStackData(CFNStack):
             self.plugin.init(self)
 
 
-    def _load_template(self):
-        import re, mmap
+    def compile(self, uploadToS3=False):
+        context, self.resolved_params, self.resolved_tags = self.prepare_context()
 
-        with open(str(self.file), 'r+') as f:
-            mp = f.read()
-            docs = re.split(r'[\r\n\s]*---[\r\n]+', mp)
-            raw_template = ""
-            raw_config = ""
+        if self.rendered is not None and self.rendered[0] == self._fingerprint(context):
+            # rendered ahead of time by CFBundle.compile_all with the same context
+            self.cfn_template = self.rendered[1]
+        else:
+            self.cfn_template, self.render_seconds = _render_stack(self.file, context, self.template_cache_dir,
+                                                                   self.plugin, self.key)
+        self.rendered = None
+        logger.debug(self.cfn_template)
+        #exit(0)
 
-            if len(docs) == 1:
-                raw_template = docs[0]
-            elif len(docs) == 2:
-                raw_template = docs[1]
-            elif len(docs) == 3:
-                raw_config = docs[1]
-                raw_template = docs[2]
+        self.digest = self._digest(context)
 
-            return (raw_config, raw_template)
+        if(uploadToS3):
+            self.upload_template()
 
-    def compile(self, uploadToS3=False):
+    def prepare_context(self):
+        """
+        Rendering context of this stack with its config, parameters and tags resolved, the stack itself keeps
+        the unresolved ones
+        :return: (context, resolved parameters, resolved tags)
+        :rtype: tuple
+        """
         for stack in self.depends_on.values():
-            if not stack.exists():
+            if not stack.variables_available():
                 raise Exception("Dependent stack %s for %s does not exist" % (stack.name, self.name))
 
+        # upstream variables are fetched once, each resolved section is put back into the context
+        # so that later sections can refer to it
         context = self._get_context()
-        self.config = self._resolve_references('config', self.config, context)
+        context['config'] = self._resolve_references('config', copy.deepcopy(self.config), context)
 
-        context = self._get_context()
-        self.params = self._resolve_references('params', self.params, context)
+        params = self._resolve_references('params', copy.deepcopy(self.params), context)
+        context['parameters'] = params
 
-        context = self._get_context()
-        self.tags = self._resolve_references('tags', self.tags, context)
+        tags = self._resolve_references('tags', copy.deepcopy(self.tags), context)
+        context['tags'] = tags
+        return context, params, tags
 
-        context = self._get_context()
-        raw_config, raw_template = self._load_template()
-
-        loader = jinja2.loaders.FileSystemLoader(str(self.file.parent))
-        jinja_env = jinja2.Environment(loader=loader, extensions=['jinja2_ansible_filters.AnsibleCoreFiltersExtension'])
-        # render config from tempalte
-        if len(raw_config.strip()) > 0:
-          template = jinja_env.from_string(raw_config)
-          template.globals['context'] = context
-          config_string = template.render(context)
-
-          local_config = yaml.safe_load(config_string)
-          local_config = self._resolve_references('config', local_config, context)
-          template_context = local_config | context
-        else:
-          template_context = context
+    def set_rendered(self, context, cfn_template, seconds):
+        """
+        Template rendered elsewhere from context, used by compile as long as the context stays the same
+        """
+        self.rendered = (self._fingerprint(context), cfn_template)
+        self.render_seconds = seconds
+
+    def _fingerprint(self, context):
+        return hashlib.sha256(json.dumps(context, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    def upload_template(self):
+        if self.template_bucket is None:
+            raise Exception("No template bucket to upload the template of %s" % self.name)
+        self.s3_url = self.template_bucket.put_template(self.name, self.cfn_template)
+        with validated_urls_lock:
+            if self.s3_url in validated_urls:
+                return
+        self.cfn_client.validate(template_url=self.s3_url)
+        with validated_urls_lock:
+            validated_urls.add(self.s3_url)
+
+    def _digest(self, context):
+        """
+        Digest over everything a deployment of this stack depends on: the rendered template, resolved parameters
+        and tags and the variables of upstream stacks. An upstream update that leaves its variables unchanged
+        does not change the digest of this stack.
+        """
+        inputs = {
+            'template': self.cfn_template,
+            'parameters': self.resolved_params,
+            'tags': self.resolved_tags,
+            'upstream': dict((key, context[key]) for key in self.depends_on)
+        }
+        return hashlib.sha256(json.dumps(inputs, sort_keys=True, default=str).encode('utf-8')).hexdigest()
 
-        if self.plugin and hasattr(self.plugin, 'prepare_context'):
-            template_context = self.plugin.prepare_context(template_context)
-            if template_context is None:
-                logger.warning("You may have forgotten to return context in plugin " + self.key+ ".py")
+    def is_uptodate(self, info):
+        """
+        Check if the compiled stack matches what was last deployed by this bundle
+        :param info: current stack info, None if the stack does not exist
+        """
+        if self.digest_store is None or info is None or info.status() not in COMPLETE_STACK_STATES:
+            return False
 
-        template_actual = jinja_env.from_string(raw_template)
-        template_actual.globals['context'] = template_context
-        self.cfn_template = template_actual.render(template_context)
-        print(self.cfn_template)
-        #exit(0)
+        digest, updated = self.digest_store.get(self.name)
+        return digest == self.digest and updated == info.updated_time()
 
-        if(uploadToS3):
-            self.s3_url = put_template_to_s3(self.name, self.cfn_template)
-            resp = self.cfn_client.validate(template_url=self.s3_url)
+    def _record_digest(self, status):
+        # upstream variables of this stack may have changed for the dependents
+        self.invalidate_variables()
+
+        if self.digest_store is None:
+            return
+        if isinstance(status, StackSuccessStatus) and status in COMPLETE_STACK_STATES:
+            self.digest_store.put(self.name, self.digest, self.get_info(True).updated_time())
+        else:
+            self.digest_store.remove(self.name)
 
     def cf_retain_constructor(self, loader, tag_suffix, node):
         return "!{} {}".format(tag_suffix, node.value)
@@ -203,58 +397,10 @@ class CFNStackData(CFNStack):
 
 
     def _resolve_references(self, name, item, context):
-        if type(item) is str:
-            return self.resolve_reference(item, context) if item.startswith("$") and not item.startswith("$$") else item
-        elif type(item) is dict:
-            for key, value in item.items():
-                item[key] = self._resolve_references(name, value, context)
-            return item
-        elif type(item) is list:
-            new_list = []
-            for list_item in item:
-                new_list.append(self._resolve_references(name, list_item, context))
-            return new_list
-        else:
-            try:
-                new_items = []
-                for sub_item in item:
-                    new_items.append(self._resolve_references(name, sub_item, context))
-                return new_items
-            except TypeError:
-                return item
+        return resolve_references(item, context)
 
     def resolve_reference(self, attr, context):
-        '''
-
-        :param attr:    config.variable
-                        parameters.variable
-                        tags.variable
-                        stack_name.outputs.variable
-                        stack_name.resources.variable
-                        stack_name.parameters.variable
-
-        :return:
-        '''
-        if attr.startswith("$"):
-            attr = attr[1:]
-
-        splits = attr.split('.')
-        base = splits[0]
-        # case of nested variables
-        env = context.get(base, None)
-        if env is None:
-            raise Exception('Can not find context %s to resolve %s' % (base, attr))
-
-        query = attr[attr.index(".") + 1:]
-        query = jmespath.compile(query)
-        data = query.search(env)
-
-        if data is not None:
-            return data
-
-        # TODO: try without qualified name
-
-        raise Exception('Failed to resolve variable %s ' % attr)
+        return resolve_reference(attr, context)
 
 ########## cleanup
     def validate(self, **kwargs):
@@ -277,15 +423,48 @@ class CFNStackData(CFNStack):
             #aws_account = user_result['user']['arn'].split(':')[4]
 
     def delete_stack(self, wait=True):
+        """
+        Delete the stack, a stack which doesn't exist (any more) counts as deleted
+        :return: final status if wait is set
+        """
+        if self.digest_store is not None:
+            self.digest_store.remove(self.name)
+        self.invalidate_variables()
+
         if not self.exists():
-            self.logger.info("Stack does not exist in aws")
+            logger.info("Stack %s does not exist in aws" % self.name)
+            return StackSuccessStatus('DELETE_COMPLETE')
 
         self.cfn_client.delete_stack(stack_name=self.name)
+        if not wait:
+            return None
 
-        return self.wait_on_events(None) if wait else None
-
-    def create_update_stack(self, wait=True):
+        status = self.wait_on_events(None)
+        # STACK_GONE also ends the event tail when the stack couldn't be described and EVENTS_UNAVAILABLE when
+        # its events couldn't be read, e.g. access denied, confirm the stack is gone before the stacks it
+        # depends on are deleted
+        while isinstance(status, StackUnknownStatus):
+            desc = self.cfn_client.refresh_stack(self.name)
+            if desc is None:
+                return StackSuccessStatus('DELETE_COMPLETE')
+            logger.warning("Stack %s still exists in status %s, waiting for the delete" % (self.name,
+                                                                                         desc['StackStatus']))
+            status = self.cfn_client.wait_for_status(self.name)
+        return status
+
+    def create_update_stack(self, wait=True, force=False, resume=False):
+        """
+        Compile the stack and create or update it in cloud formation
+        :param force: deploy even if the stack digest matches the last deployment
+        :param resume: continue from the journal of a previous run, completed stacks are skipped and
+                       operations submitted by that run are waited for instead of submitted again
+        """
+        if resume and self.journal is not None:
+            status = self._resume(self.journal.last(self.name))
+            if status is not None:
+                return status
 
+        info = None
         if self.exists():
             info = self.get_info(True)
             if info.statusInProgress():
@@ -298,19 +477,77 @@ class CFNStackData(CFNStack):
 
             if info and info.status() == 'CREATE_FAILED':
                 self.delete_stack()
+                info = None
 
-        self.compile(uploadToS3=True)
+        self.compile()
+        self._journal(cfn_journal.COMPILED, digest=self.digest)
 
-        if self.exists():
-            resp = self.cfn_client.update_stack(stack_name=self.name, template_url=self.s3_url, parameters=self.params)
+        if not force and self.is_uptodate(info):
+            logger.info("Stack %s is up to date, skipping" % self.name)
+            status = StackSuccessStatus(info.status())
+            self._journal(cfn_journal.COMPLETED, digest=self.digest, status=str(status), skipped=True)
+            return status
+
+        self.upload_template()
+        self._journal(cfn_journal.UPLOADED, digest=self.digest, template_url=self.s3_url)
+
+        if info is not None:
+            resp = self.cfn_client.update_stack(stack_name=self.name, template_url=self.s3_url,
+                                                parameters=self.resolved_params)
             if resp:
                 logger.info('StackID:%s'%resp['StackId'])
-            return self.wait_on_events(None) if wait else None
+                self._journal(cfn_journal.SUBMITTED, digest=self.digest, stack_id=resp['StackId'], operation='update')
+            status = self.wait_on_events(None) if wait else None
         else:
-            resp = self.cfn_client.create_stack(stack_name=self.name, template_url=self.s3_url, parameters=self.params)
+            resp = self.cfn_client.create_stack(stack_name=self.name, template_url=self.s3_url,
+                                                parameters=self.resolved_params)
             if resp:
                 logger.info('StackID:%s' % resp['StackId'])
-            return self.wait_on_events(0) if wait else None
+                self._journal(cfn_journal.SUBMITTED, digest=self.digest, stack_id=resp['StackId'], operation='create')
+            status = self.wait_on_events(0) if wait else None
+
+        if wait:
+            self._record_digest(status)
+            self._journal(cfn_journal.COMPLETED if isinstance(status, StackSuccessStatus) else cfn_journal.FAILED,
+                          digest=self.digest, status=str(status))
+        return status
+
+    def _journal(self, phase, **details):
+        if self.journal is not None:
+            self.journal.record(self.name, phase, **details)
+
+    def _resume(self, entry):
+        """
+        Pick the stack up where the journal left it
+        :return: final status, or None if the stack has to be deployed
+        """
+        if entry is None:
+            return None
+
+        if entry['phase'] == cfn_journal.COMPLETED:
+            logger.info("Stack %s completed in the previous run, skipping" % self.name)
+            return StackSuccessStatus(entry.get('status', 'COMPLETED'))
+
+        if entry['phase'] != cfn_journal.SUBMITTED:
+            return None
+
+        info = self.get_info(True)
+        if info is None or info.desc['StackId'] != entry['stack_id']:
+            # the submitted stack is gone, e.g. a failed create was deleted since
+            return None
+
+        if info.statusInProgress():
+            logger.info("Re-attaching to the %s of stack %s" % (entry['operation'], self.name))
+            status = self.wait_on_events(None)
+        else:
+            status = terminal_status(info.status())
+
+        # the digest the operation was submitted with
+        self.digest = entry['digest']
+        self._record_digest(status)
+        self._journal(cfn_journal.COMPLETED if isinstance(status, StackSuccessStatus) else cfn_journal.FAILED,
+                      digest=self.digest, status=str(status), stack_id=entry['stack_id'])
+        return status
 
 
     def apply(self, op=1, strict=True, wait=True):
@@ -367,25 +604,32 @@ class CFNStackData(CFNStack):
             return self.wait_on_events(0) if wait else None
 
     def wait_on_events(self, start_event_log):
+        """
+        Log the events of the running stack operation until it finishes
+        :return: final status, StackUnknownStatus if the outcome is not known, never None
+        """
         stack_events_iterator = self.cfn_client.tail_stack_events(self.name, start_event_log)
 
         if stack_events_iterator is None:
-            return
+            # the operation may well be running still, don't report it as finished
+            return StackUnknownStatus('EVENTS_UNAVAILABLE')
 
         for event in stack_events_iterator:
             if isinstance(event, StackFailStatus):
-                logger.error('Stack operation failed: %s', event)
+                logger.error('Stack %s operation failed: %s', self.name, event)
                 return event
             elif isinstance(event, StackSuccessStatus):
-                logger.info('Stack operation succeeded: %s', event)
+                logger.info('Stack %s operation succeeded: %s', self.name, event)
                 return event
             elif isinstance(event, StackUnknownStatus):
-                logger.info('Stack operation unknown: %s', event)
+                logger.info('Stack %s operation unknown: %s', self.name, event)
                 return event
             else:
+                # stacks run concurrently, prefix events with the stack they belong to
                 logger.info(
-                    '%(resource_type)s %(logical_resource_id)s %(physical_resource_id)s %(resource_status)s %(resource_status_reason)s',
-                    event)
+                    '[%s] %s %s %s %s %s', self.name, event['resource_type'], event['logical_resource_id'],
+                    event['physical_resource_id'], event['resource_status'], event['resource_status_reason'])
+        return StackUnknownStatus('EVENTS_UNAVAILABLE')
 
     def wait_for_status(self):
         self.cfn_client.wait_for_status(self.name)
@@ -422,63 +666,61 @@ class CFNStackData(CFNStack):
 
     def create_change_set(self, change_set_name):
         """
-        creat and get the change set from AWS
+        Compile and upload the template and create a change set against the deployed stack, the change set
+        is created asynchronously by CFN, see CFBundle.preview
+        :return: change set id or None if the stack does not exist
         """
-        stack_info = self.cfn_client.describe_stack(self.name)
-        if stack_info is None:
+        if self.get_info() is None:
             return None
 
-        change_set_name = "cfn_stack_" + self.name
-        #blindly delete existing change set
-        del_status = self.cfn_client.delete_change_set(self.name, change_set_name)
-        cre_status = self.cfn_client.create_change_set(self.name, template=self.template_body, parameters=self.params)
+        self.compile(uploadToS3=True)
+        return self.cfn_client.create_change_set(self.name, change_set_name, self.s3_url, self.resolved_params)
 
+    def delete_change_set(self, change_set_name):
+        try:
+            self.cfn_client.delete_change_set(self.name, change_set_name)
+        except Exception as ex:
+            logger.warning("Failed to delete change set %s of stack %s: %s" % (change_set_name, self.name, ex))
 
-    def template_uptodate(self):
+    def template_uptodate(self, info=None):
         """
-        Check if template in this stack is update date with CFN
+        Check if the compiled template matches the deployed one, templates are compared by the hash of their
+        canonical form so format, key order and whitespace don't matter
+        :param info: deployed stack, described when not given
         """
-        stack_info = self.cfn_client.describe_stack(self.name)
-        if stack_info is None:
+        if info is None:
+            info = self.get_info()
+        if info is None:
             return False
+        return info.template_hash() == self.template_hash()
 
-        rem_template = json.loads(stack_info.template())
-        loc_template = json.loads(self.template_body)
-        if rem_template == loc_template:
-                return True
-        return False
-
-    def params_uptodate(self, current_cf_stacks):
+    def template_hash(self):
         """
-        Check if parameters in this stack are up to date with CFN
+        Hash of the canonical compiled template, computed once per compile
         """
-        stack_info = self.cfn_client.get_info(self.name)
-        if stack_info is None:
-            return False
+        if self._template_hash is None or self._template_hash[0] is not self.cfn_template:
+            self._template_hash = (self.cfn_template, template_hash(self.cfn_template))
+        return self._template_hash[1]
 
-        # If number of params in CF and this stack obj dont match,
-        # then it needs updating
-        if len(stack_info.parameters()) != len(self.params):
-            msg = "New and old parameter lists are different lengths for %s"
-            self.logger.debug(msg, self.name)
+    def params_uptodate(self, info=None):
+        """
+        Check if the compiled parameters of this stack match the deployed ones. Parameters only in CFN have their
+        default value and NoEcho parameters can not be compared, both are treated as up to date.
+        :param info: deployed stack, described when not given
+        """
+        if info is None:
+            info = self.get_info()
+        if info is None:
             return False
 
-        for param in stack_info.parameters():
-            # check if param in CF exists in our new parameter set,
-            # if not they are differenet and need updating
-            key = param.key
-            value = param.value
-            if key not in self.params:
-                msg = ("New params are missing key %s that exists in CF " +
-                       "for %s stack already.")
-                self.logger.debug(msg, key, self.name)
+        deployed = dict((param['ParameterKey'], param.get('ParameterValue')) for param in info.parameters())
+        for key, value in self.resolved_params.items():
+            if key not in deployed:
+                logger.debug("Param %s of stack %s is not in CFN" % (key, self.name))
                 return False
-            # if the value of parameters are different, needs updating
-            if self.params[key] != value:
-                msg = "Param %s for stack %s has changed from %s to %s"
-                self.logger.debug(msg, key, self.name,
-                                  value, self.params[key])
+            if deployed[key] == '****':
+                continue
+            if _param_value(value) != deployed[key]:
+                logger.debug("Param %s for stack %s has changed from %s to %s" % (key, self.name, deployed[key], value))
                 return False
-
-        # We got to the end without returning False, so must be fine.
         return True
@@ -0,0 +1,144 @@
+# Copyright Prakash Sidaraddi.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+"""
+Local state of a bundle kept next to the bundle file
+"""
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+STATE_DIR = '.stormation'
+
+
+def state_path(bundle_path, bundle_name, suffix):
+    """
+    Path of a state file for a bundle, e.g. <bundle dir>/.stormation/<bundle name>.<suffix>
+    """
+    return Path(bundle_path, STATE_DIR, "%s.%s" % (bundle_name, suffix))
+
+
+class StackDigestStore(object):
+    """
+    Digests of the inputs each stack was last deployed with. A stack is only deployed again when the digest
+    of its rendered template, parameters, tags and upstream variables changes, or when the stack was modified
+    outside of this bundle (detected through its last updated time).
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._digests = dict()
+        if self.path.is_file():
+            try:
+                with open(str(self.path), 'r') as f:
+                    self._digests = json.load(f)
+            except ValueError:
+                logger.warning("Ignoring corrupt stack digest file %s" % self.path)
+
+    def get(self, stack_name):
+        """
+        :return: (digest, updated_time) the stack was last deployed with or (None, None)
+        """
+        entry = self._digests.get(stack_name, {})
+        return entry.get('digest'), entry.get('updated')
+
+    def put(self, stack_name, digest, updated):
+        with self._lock:
+            self._digests[stack_name] = {'digest': digest, 'updated': updated}
+            self._save()
+
+    def remove(self, stack_name):
+        with self._lock:
+            if self._digests.pop(stack_name, None) is not None:
+                self._save()
+
+    def _save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = str(self.path) + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self._digests, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, str(self.path))
+
+
+class StackOutputsStore(object):
+    """
+    Variables (Parameters, Outputs and Resources) of the stacks of a bundle run. Each stack is fetched once
+    and shared by all its dependents until the stack is invalidated, which happens when this run deploys it.
+    With a path the variables are also kept on disk, an offline store serves them from there without
+    calling the cloud formation API.
+    """
+
+    def __init__(self, path=None, offline=False):
+        self.path = Path(path) if path else None
+        self.offline = offline
+        self._lock = threading.Lock()
+        self._stack_locks = dict()
+        # stack name -> variables
+        self._variables = dict()
+        # stacks fetched or loaded during this run and not invalidated since
+        self._current = set()
+
+        if self.path is not None and self.path.is_file():
+            try:
+                with open(str(self.path), 'r') as f:
+                    self._variables = json.load(f)
+            except ValueError:
+                logger.warning("Ignoring corrupt stack outputs file %s" % self.path)
+        elif offline:
+            logger.warning("No stored stack outputs for offline use, stacks will be fetched from cloud formation")
+
+    def has(self, stack_name):
+        """
+        :return: True if the variables of the stack can be served without calling the API
+        """
+        return stack_name in self._current or (self.offline and stack_name in self._variables)
+
+    def get(self, stack_name, fetch):
+        """
+        Variables of a stack, fetched at most once per run
+        :param fetch: callable returning the variables of the stack from cloud formation
+        """
+        with self._stack_lock(stack_name):
+            if not self.has(stack_name):
+                variables = fetch()
+                with self._lock:
+                    self._variables[stack_name] = variables
+                    self._current.add(stack_name)
+                    self._save()
+            return self._variables[stack_name]
+
+    def invalidate(self, stack_name):
+        """
+        The stack changed, fetch it again next time even when offline
+        """
+        with self._lock:
+            self._current.discard(stack_name)
+            if self._variables.pop(stack_name, None) is not None:
+                self._save()
+
+    def _stack_lock(self, stack_name):
+        with self._lock:
+            return self._stack_locks.setdefault(stack_name, threading.Lock())
+
+    def _save(self):
+        if self.path is None:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = str(self.path) + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self._variables, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, str(self.path))
@@ -0,0 +1,91 @@
+# Copyright Prakash Sidaraddi.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+"""
+Canonical form of cloud formation templates.
+Json and yaml templates, short form intrinsic functions like !Ref or !GetAtt included, are parsed into
+the structure cloud formation works with, so two templates compare equal whatever their format,
+key order or whitespace.
+"""
+import hashlib
+import json
+import logging
+
+import yaml
+
+logger = logging.getLogger(__name__)
+
+
+class CFNYamlLoader(yaml.SafeLoader):
+    """
+    Safe yaml loader understanding the cloud formation short form tags. Timestamps stay strings,
+    cloud formation doesn't convert them either (e.g. AWSTemplateFormatVersion: 2010-09-09).
+    """
+    yaml_implicit_resolvers = dict((first, [(tag, regexp) for tag, regexp in resolvers
+                                            if tag != 'tag:yaml.org,2002:timestamp'])
+                                   for first, resolvers in yaml.SafeLoader.yaml_implicit_resolvers.items())
+
+
+def _construct_node(loader, node):
+    if isinstance(node, yaml.ScalarNode):
+        return loader.construct_scalar(node)
+    if isinstance(node, yaml.SequenceNode):
+        return loader.construct_sequence(node, deep=True)
+    return loader.construct_mapping(node, deep=True)
+
+
+def _construct_intrinsic(loader, tag_suffix, node):
+    value = _construct_node(loader, node)
+    if tag_suffix in ('Ref', 'Condition'):
+        return {tag_suffix: value}
+    if tag_suffix == 'GetAtt' and isinstance(value, str):
+        # !GetAtt Resource.Attribute, the attribute itself may contain dots
+        return {'Fn::GetAtt': value.split('.', 1)}
+    return {'Fn::' + tag_suffix: value}
+
+
+CFNYamlLoader.add_multi_constructor('!', _construct_intrinsic)
+
+
+def parse_template(body):
+    """
+    Parse a json or yaml template
+    :param body: template text or a template already parsed, e.g. a json TemplateBody returned by boto
+    :rtype: dict
+    """
+    if isinstance(body, dict):
+        return body
+    try:
+        return json.loads(body)
+    except ValueError:
+        return yaml.load(body, Loader=CFNYamlLoader)
+
+
+def canonical_template(body):
+    """
+    Template as json with sorted keys and no whitespace, the same for every representation of a template
+    :rtype: str
+    """
+    try:
+        template = parse_template(body)
+    except yaml.YAMLError as ex:
+        logger.warning("Comparing unparsable template as text: %s" % ex)
+        return body.strip()
+    return json.dumps(template, sort_keys=True, separators=(',', ':'), default=str)
+
+
+def template_hash(body):
+    """
+    :return: sha256 of the canonical template
+    :rtype: str
+    """
+    return hashlib.sha256(canonical_template(body).encode('utf-8')).hexdigest()
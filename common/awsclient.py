@@ -11,12 +11,27 @@
 # ANY KIND, either express or implied. See the License for the specific
 # language governing permissions and limitations under the License.
 
-import time
-import jmespath
 import logging
+from botocore.config import Config
 
 from common.awssession import get_session
+from common.jmespathhelper import compile_expression
 from common.exception import ClientError
+from common.ratelimit import get_limiter
+
+# retries are done by the shared RateLimiter, see common.ratelimit
+BOTO_CONFIG = Config(retries={'total_max_attempts': 1, 'mode': 'standard'})
+
+# http connections kept per botocore client, a client is shared by all threads using the same service and region
+DEFAULT_MAX_POOL_CONNECTIONS = 10
+
+
+def client_config(max_pool_connections=None):
+    """
+    Client config with the connection pool size, threads beyond it wait for a connection
+    :rtype: botocore.config.Config
+    """
+    return BOTO_CONFIG.merge(Config(max_pool_connections=max_pool_connections or DEFAULT_MAX_POOL_CONNECTIONS))
 
 LOG = logging.getLogger(__name__)
 
@@ -32,12 +47,21 @@ class AWSClient(object):
         self._service_name = service_name
         self._region_name = region_name
         self._kwargs = kwargs
-        self._boto_client = self._session.client(service_name, region_name)
+        self._max_pool_connections = kwargs.get('max_pool_connections', None)
+        # pooled by the session, see AWSSession.client
+        self._boto_client = self._session.client(service_name, region_name,
+                                                 config=client_config(self._max_pool_connections))
+        # clients of other services returned by get_client
+        self._clients = dict()
         if self._boto_client is None:
             raise ClientError("0", "Failed to connect to AWS service", "get boto client")
         if self._region_name is None:
             self._region_name = self._session.default_region
 
+        # rate limiters are per account, the limiter is looked up with the first request so that creating
+        # a client doesn't need the caller identity
+        self._limiter = None
+
     @property
     def service_name(self):
         return self._service_name
@@ -60,7 +84,28 @@ class AWSClient(object):
 
     @property
     def user_id(self):
-        return self._user_id
+        return self._session.user_id
+
+    @property
+    def limiter(self):
+        """
+        RateLimiter shared by all clients of this service, region and account
+        """
+        self._attach_limiter()
+        return self._limiter
+
+    def _attach_limiter(self):
+        if self._limiter is None:
+            limiter = get_limiter(self._service_name, self._region_name, self._session.account_id)
+            limiter.attach(self._boto_client)
+            self._limiter = limiter
+
+    @property
+    def metrics(self):
+        """
+        Request, throttle and retry counters shared by all clients of this service, region and account
+        """
+        return self.limiter.metrics.as_dict()
 
     def get_client(self, service_name, region_name=None):
         """
@@ -69,7 +114,55 @@ class AWSClient(object):
         :param region_name:
         :return:
         """
-        return AWSClient(service_name, region_name, session=self.session)
+        key = (service_name, region_name)
+        client = self._clients.get(key)
+        if client is None:
+            client = AWSClient(service_name, region_name, session=self.session,
+                               max_pool_connections=self._max_pool_connections)
+            self._clients[key] = client
+        return client
+
+    def pages(self, op_name, **kwargs):
+        """
+        Generator over the raw response pages of an operation. Pages are only requested as they
+        are consumed, so a caller can stop before the last page. Operations which can not be
+        paginated yield their single response.
+        :type op_name: str
+        :param op_name: The name of the request you wish to make.
+        """
+        LOG.debug(kwargs)
+        self._attach_limiter()
+        if self._boto_client.can_paginate(op_name):
+            paginator = self._boto_client.get_paginator(op_name)
+            for page in paginator.paginate(**kwargs):
+                yield page
+        else:
+            yield getattr(self._boto_client, op_name)(**kwargs)
+
+    def iter_call(self, op_name, query=None, **kwargs):
+        """
+        Streaming variant of call(). Pages are requested as the results are consumed and the
+        jmespath query is applied to each page on its own, so memory use does not grow with the
+        number of pages and the first results are available before the last page arrives.
+        A query returning a list yields its items, any other non null result is yielded as is.
+        Queries have to select within one page, e.g. 'Reservations[].Instances[]', functions
+        aggregating over all results like length() apply per page.
+        :type op_name: str
+        :param op_name: The name of the request you wish to make.
+        :type query: str
+        :param query: A jmespath query applied to every page.
+        """
+        if query:
+            query = compile_expression(query)
+        for page in self.pages(op_name, **kwargs):
+            data = query.search(page) if query else page
+            if data is None:
+                continue
+            if isinstance(data, list):
+                for item in data:
+                    yield item
+            else:
+                yield data
 
     def call(self, op_name, query=None, **kwargs):
         """
@@ -83,6 +176,8 @@ class AWSClient(object):
             will be applied to the data returned from the low-level
             call.  This allows you to tailor the returned data to be
             exactly what you want.
+          * Requests are rate limited and throttled requests are
+            retried, see common.ratelimit.
         :type op_name: str
         :param op_name: The name of the request you wish to make.
         :type query: str
@@ -94,30 +189,15 @@ class AWSClient(object):
             to the method when making the request.
         """
         LOG.debug(kwargs)
+        self._attach_limiter()
         if query:
-            query = jmespath.compile(query)
+            query = compile_expression(query)
         if self._boto_client.can_paginate(op_name):
             paginator = self._boto_client.get_paginator(op_name)
             results = paginator.paginate(**kwargs)
             data = results.build_full_result()
         else:
-            op = getattr(self._boto_client, op_name)
-            done = False
-            data = {}
-            while not done:
-                try:
-                    data = op(**kwargs)
-                    done = True
-                except ClientError as e:
-                    LOG.debug(e, kwargs)
-                    if 'Throttling' in str(e):
-                        time.sleep(1)
-                    elif 'AccessDenied' in str(e):
-                        raise e
-                        done = True
-                except Exception as e:
-                    raise e
-                    done = True
+            data = getattr(self._boto_client, op_name)(**kwargs)
         if query:
             data = query.search(data)
         return data
@@ -11,28 +11,109 @@
 # ANY KIND, either express or implied. See the License for the specific
 # language governing permissions and limitations under the License.
 
+import hashlib
+import json
 import logging
+import threading
+import time
+from pathlib import Path
 import boto3
+import botocore.session
+from botocore.credentials import DeferredRefreshableCredentials
 import os
 
 LOG = logging.getLogger(__name__)
 
 
 
+# assumed role credentials are requested for this long and refreshed by botocore before they expire
+ROLE_SESSION_DURATION = 3600
+
+# seconds a cached caller identity is used before STS is asked again
+IDENTITY_CACHE_TTL = 900
+
+
+class IdentityCache(object):
+    """
+    Caller identities (account and user id) on disk by credential fingerprint, so that new processes
+    don't call sts get_caller_identity for credentials seen a moment ago. The cache is best effort,
+    a cache that can't be read or written is ignored.
+    """
+
+    def __init__(self, path=None, ttl=IDENTITY_CACHE_TTL):
+        if path is None:
+            cache_home = os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+            path = os.path.join(cache_home, 'stormation', 'identity.json')
+        self.path = Path(path)
+        self.ttl = ttl
+        self._lock = threading.Lock()
+
+    def get(self, fingerprint):
+        """
+        :return: dict with account and user_id or None if not cached or expired
+        """
+        with self._lock:
+            entry = self._load().get(fingerprint)
+        if entry is None or time.time() - entry.get('time', 0) > self.ttl:
+            return None
+        return entry
+
+    def put(self, fingerprint, account, user_id):
+        with self._lock:
+            entries = self._load()
+            now = time.time()
+            entries = dict((key, entry) for key, entry in entries.items() if now - entry.get('time', 0) <= self.ttl)
+            entries[fingerprint] = {'account': account, 'user_id': user_id, 'time': now}
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                tmp_path = "%s.%d.tmp" % (self.path, os.getpid())
+                with open(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as f:
+                    json.dump(entries, f)
+                os.replace(tmp_path, str(self.path))
+            except OSError as ex:
+                LOG.debug("Can't write identity cache %s: %s" % (self.path, ex))
+
+    def _load(self):
+        try:
+            with open(str(self.path), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return dict()
+
+
+identity_cache = IdentityCache()
+
+
 class AWSSession(object):
 
-    def __init__(self, default_region=None, profile=None, credentials=None, **kwargs):
+    def __init__(self, default_region=None, profile=None, credentials=None, role_arn=None, **kwargs):
+        """
+        :param role_arn: role to assume with the credentials of the profile or the given credentials
+        :param kwargs: external_id and role_session_name for the assumed role
+        """
         self._default_region = default_region
         # no aws_creds, need profile to get creds from ~/.aws/credentials
         self._profile = profile
+        self._role_arn = role_arn
+        # botocore clients are thread safe and expensive to create, they are created once per session
+        self._clients = dict()
+        self._clients_lock = threading.Lock()
+        # caller identity, resolved on first use
+        self._account_id = None
+        self._user_id = None
+        self._identity_lock = threading.Lock()
 
         if credentials:
-            self._session = boto3.Session(**self.credentials)
+            self._session = boto3.Session(**credentials)
         elif profile:
             self._session = boto3.Session(profile_name=profile)  
         else:
             self._session = boto3.Session()
 
+        if role_arn:
+            self._session = self._assume_role(self._session, role_arn, kwargs.get('external_id'),
+                                              kwargs.get('role_session_name', 'stormation'))
+
         self.placebo = kwargs.get('placebo')
         self.placebo_dir = kwargs.get('placebo_dir')
         self.placebo_mode = kwargs.get('placebo_mode', 'record')
@@ -44,7 +125,32 @@ class AWSSession(object):
             elif self.placebo_mode == 'playback':
                 pill.playback()
 
-        self._fetch_account_info()
+    @staticmethod
+    def _assume_role(base_session, role_arn, external_id, role_session_name):
+        """
+        Session with the credentials of an assumed role. The role is assumed on first use and again shortly
+        before the credentials expire, so long deployments never run with expired credentials.
+        """
+        sts = base_session.client('sts')
+
+        def refresh():
+            request = dict(RoleArn=role_arn, RoleSessionName=role_session_name, DurationSeconds=ROLE_SESSION_DURATION)
+            if external_id:
+                request['ExternalId'] = external_id
+            LOG.info("Assuming role %s" % role_arn)
+            credentials = sts.assume_role(**request)['Credentials']
+            return {'access_key': credentials['AccessKeyId'],
+                    'secret_key': credentials['SecretAccessKey'],
+                    'token': credentials['SessionToken'],
+                    'expiry_time': credentials['Expiration'].isoformat()}
+
+        botocore_session = botocore.session.get_session()
+        botocore_session._credentials = DeferredRefreshableCredentials(refresh, 'sts-assume-role')
+        return boto3.Session(botocore_session=botocore_session)
+
+    @property
+    def role_arn(self):
+        return self._role_arn
 
     @property
     def default_region(self):
@@ -52,31 +158,101 @@ class AWSSession(object):
 
     @property
     def account_id(self):
+        self._fetch_account_info()
         return self._account_id
 
     @property
     def user_id(self):
+        self._fetch_account_info()
         return self._user_id
 
     def _fetch_account_info(self):
-        client = self._session.client("sts")
-        data = client.get_caller_identity()
-        self._account_id = data["Account"]
-        self._user_id = data["UserId"]
+        with self._identity_lock:
+            if self._account_id is not None:
+                return
+
+            # recorded or played back sessions always talk to sts
+            fingerprint = self._identity_fingerprint() if not self.placebo else None
+            cached = identity_cache.get(fingerprint) if fingerprint else None
+            if cached is not None:
+                self._account_id = cached['account']
+                self._user_id = cached['user_id']
+                return
+
+            client = self._session.client("sts")
+            data = client.get_caller_identity()
+            self._account_id = data["Account"]
+            self._user_id = data["UserId"]
+            if fingerprint:
+                identity_cache.put(fingerprint, self._account_id, self._user_id)
+
+    def _identity_fingerprint(self):
+        """
+        Fingerprint of the identity behind this session, the access key id identifies the caller,
+        an assumed role is identified without assuming it
+        """
+        if self._role_arn:
+            return credentials_fingerprint({'role_arn': self._role_arn})
+        credentials = self._session.get_credentials()
+        if credentials is None:
+            return None
+        return credentials_fingerprint({'access_key': credentials.access_key})
+
+    @property
+    def profile(self):
+        return self._profile
 
     def client(self, service_name, region_name=None, **kwargs):
+        """
+        Shared botocore client of this session for service, region and client arguments
+        """
         if region_name is None:
             region_name = self.default_region
 
-        return self._session.client(service_name=service_name, region_name=region_name, **kwargs)
+        key = (service_name, region_name, _client_args_key(kwargs))
+        with self._clients_lock:
+            client = self._clients.get(key)
+            if client is None:
+                client = self._session.client(service_name=service_name, region_name=region_name, **kwargs)
+                self._clients[key] = client
+        return client
+
+
+def _client_args_key(kwargs):
+    key = []
+    for name, value in sorted(kwargs.items()):
+        if name == 'config' and value is not None:
+            # botocore Config objects don't compare by value
+            value = sorted(value._user_provided_options.items())
+        key.append((name, repr(value)))
+    return tuple(key)
+
+
+def credentials_fingerprint(credentials):
+    """
+    Fingerprint identifying credentials without keeping the secret around
+    """
+    if not credentials:
+        return None
+    return hashlib.sha256(json.dumps(credentials, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def session_key(region_name=None, profile=None, credentials=None, role_arn=None, **kwargs):
+    """
+    Key of the session get_session returns for these arguments
+    """
+    return (region_name, profile, credentials_fingerprint(credentials), role_arn)
 
-# sessions by profile
+# sessions by region, profile, credentials and assumed role, see session_key
 sessions = dict()
+sessions_lock = threading.Lock()
 
 
 def get_session(region_name=None, profile=None, **kwargs):
-    session = sessions.get(profile)
-    if session is None:
-        session = AWSSession(region_name, profile, **kwargs)
-        sessions[profile] = session
-    return session
\ No newline at end of file
+    key = session_key(region_name, profile, **kwargs)
+    with sessions_lock:
+        session = sessions.get(key)
+        if session is None:
+            session = AWSSession(region_name, profile, **kwargs)
+            sessions[key] = session
+    return session
@@ -0,0 +1,47 @@
+# Copyright Prakash Sidaraddi.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+"""
+Process wide cache of compiled jmespath expressions, so that expressions evaluated for every
+resource, reference or API call are parsed only once
+"""
+import functools
+import jmespath
+
+# maximum number of compiled expressions kept, least recently used ones are dropped
+CACHE_SIZE = 1024
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def compile_expression(expression):
+    """
+    :param expression: jmespath expression
+    :type expression: str
+    :return: compiled expression, shared between callers
+    :rtype: jmespath.parser.ParsedResult
+    """
+    return jmespath.compile(expression)
+
+
+def search(expression, data):
+    """
+    Same as jmespath.search with the compiled expression taken from the cache
+    """
+    return compile_expression(expression).search(data)
+
+
+def cache_info():
+    """
+    :return: hits, misses, maxsize and currsize of the expression cache
+    :rtype: functools._CacheInfo
+    """
+    return compile_expression.cache_info()
@@ -0,0 +1,199 @@
+# Copyright Prakash Sidaraddi.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+"""
+Client side rate limiting and retries of AWS API calls.
+One RateLimiter is shared by all clients of the same service, region and account. It hooks into the
+botocore event system, so every HTTP request takes a token, paginated calls included, and throttled
+or transient failures are retried with capped exponential backoff and full jitter.
+"""
+import logging
+import random
+import threading
+import time
+
+import botocore.exceptions
+
+LOG = logging.getLogger(__name__)
+
+THROTTLING_ERRORS = ('Throttling', 'ThrottlingException', 'ThrottledException', 'RequestThrottledException',
+                     'TooManyRequestsException', 'ProvisionedThroughputExceededException',
+                     'TransactionInProgressException', 'RequestLimitExceeded', 'BandwidthLimitExceeded',
+                     'RequestThrottled', 'SlowDown', 'EC2ThrottledException', 'PriorRequestNotComplete')
+
+TRANSIENT_ERRORS = ('RequestTimeout', 'RequestTimeoutException', 'ServiceUnavailable', 'InternalError',
+                    'InternalFailure', 'ServiceUnavailableException')
+
+# (requests per second, burst) per service
+DEFAULT_RATE = (10, 20)
+SERVICE_RATES = {
+    'cloudformation': (5, 10),
+}
+
+
+def is_throttling(ex):
+    """
+    :return: True if the exception is a throttling error returned by AWS
+    """
+    return isinstance(ex, botocore.exceptions.ClientError) and \
+           ex.response.get('Error', {}).get('Code') in THROTTLING_ERRORS
+
+
+class TokenBucket(object):
+    """
+    Thread safe token bucket, a caller reserves a token and sleeps until the token is due
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self._tokens = self.burst
+        self._time = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Take one token, blocking until it is available
+        :return: seconds waited
+        :rtype: float
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._time) * self.rate)
+            self._time = now
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def drain(self):
+        """
+        Drop the burst allowance, used when the service throttled us anyway
+        """
+        with self._lock:
+            self._tokens = min(self._tokens, 0)
+
+
+class RetryPolicy(object):
+
+    def __init__(self, max_attempts=8, base_delay=0.5, max_delay=20):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempts):
+        """
+        Capped exponential backoff with full jitter
+        :param attempts: number of attempts made so far
+        """
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempts)))
+
+
+class CallMetrics(object):
+    """
+    Counters of one rate limiter
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.throttles = 0
+        self.retries = 0
+        self.retry_delay = 0.0
+        self.rate_limit_delay = 0.0
+
+    def as_dict(self):
+        return dict(self.__dict__)
+
+
+class RateLimiter(object):
+
+    def __init__(self, key, rate, burst, retry_policy=None):
+        self.key = key
+        self.bucket = TokenBucket(rate, burst)
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+        self.metrics = CallMetrics()
+        self._lock = threading.Lock()
+
+    def attach(self, boto_client):
+        """
+        Register the rate limiter on a botocore client, registering the same client again is a no-op
+        """
+        events = boto_client.meta.events
+        events.register('request-created', self._before_request, unique_id='stormation-rate-limit')
+        events.register('needs-retry', self._needs_retry, unique_id='stormation-retry')
+
+    def _before_request(self, **kwargs):
+        waited = self.bucket.acquire()
+        with self._lock:
+            self.metrics.requests += 1
+            self.metrics.rate_limit_delay += waited
+
+    def _needs_retry(self, response=None, attempts=None, caught_exception=None, operation=None, **kwargs):
+        """
+        botocore sleeps for the returned number of seconds and retries, None means no retry
+        """
+        if response is not None:
+            http_response, parsed = response
+            code = parsed.get('Error', {}).get('Code') if isinstance(parsed, dict) else None
+            retryable = code in THROTTLING_ERRORS or code in TRANSIENT_ERRORS or \
+                        http_response.status_code >= 500
+        else:
+            code = type(caught_exception).__name__
+            retryable = isinstance(caught_exception, (botocore.exceptions.ConnectionError,
+                                                      botocore.exceptions.HTTPClientError))
+        if not retryable:
+            return None
+
+        throttled = code in THROTTLING_ERRORS
+        if throttled:
+            self.bucket.drain()
+
+        with self._lock:
+            if throttled:
+                self.metrics.throttles += 1
+            if attempts >= self.retry_policy.max_attempts:
+                LOG.warning('Giving up %s %s after %d attempts: %s' % (self.key, operation.name if operation else '',
+                                                                      attempts, code))
+                return None
+            delay = self.retry_policy.delay(attempts)
+            self.metrics.retries += 1
+            self.metrics.retry_delay += delay
+
+        LOG.debug('Retrying %s %s in %.2fs after %s' % (self.key, operation.name if operation else '', delay, code))
+        return delay
+
+
+# rate limiters by (service, region, account)
+limiters = dict()
+limiters_lock = threading.Lock()
+
+
+def get_limiter(service_name, region_name, account_id):
+    key = (service_name, region_name, account_id)
+    with limiters_lock:
+        limiter = limiters.get(key)
+        if limiter is None:
+            rate, burst = SERVICE_RATES.get(service_name, DEFAULT_RATE)
+            limiter = RateLimiter(key, rate, burst)
+            limiters[key] = limiter
+    return limiter
+
+
+def get_metrics():
+    """
+    :return: counters of all rate limiters by (service, region, account)
+    :rtype: dict
+    """
+    with limiters_lock:
+        return dict((key, limiter.metrics.as_dict()) for key, limiter in limiters.items())
@@ -1,29 +1,114 @@
+import hashlib
 import logging
+import threading
 from common.awsclient import AWSClient
 from botocore.errorfactory import ClientError
 
 logger = logging.getLogger(__name__)
 
-aws_client = AWSClient('s3')
-
-s3_bucket_name = "stormation"
-def init(bucket_name):
-    global s3_bucket_name
-    s3_bucket_name = bucket_name.lower() + "-" + aws_client.account_id
-    try:
-        aws_client.call("create_bucket", query="@", Bucket=s3_bucket_name, ACL='private', CreateBucketConfiguration={
-            'LocationConstraint': 'us-west-2'
-        })
-    except ClientError as e:
-        if e.response['Error']['Code'] not in ["BucketAlreadyOwnedByYou", "BucketAlreadyExists"]:
+# templates are stored by the sha256 of their body, so a key never changes content and its url is immutable
+TEMPLATE_PREFIX = "templates"
+
+# (bucket, key) known to be in s3, saves the HEAD request for templates uploaded before in this process
+uploaded_keys = set()
+# (account, region, bucket) known to exist
+known_buckets = set()
+known_lock = threading.Lock()
+
+
+class TemplateBucket(object):
+    """
+    S3 bucket holding the rendered templates of a bundle, named <bucket name>-<account>.
+    Nothing is sent to AWS before the first upload, the bucket is only created when an upload finds it missing.
+    """
+
+    def __init__(self, bucket_name, region_name=None, **kwargs):
+        self.bucket_prefix = bucket_name.lower()
+        self.region_name = region_name
+        self.kwargs = kwargs
+        self._aws_client = None
+        self._lock = threading.Lock()
+
+    @property
+    def aws_client(self):
+        with self._lock:
+            if self._aws_client is None:
+                self._aws_client = AWSClient('s3', self.region_name, **self.kwargs)
+                if self.region_name is None:
+                    self.region_name = self._aws_client.region_name
+            return self._aws_client
+
+    @property
+    def bucket_name(self):
+        return self.bucket_prefix + "-" + self.aws_client.account_id
+
+    def create_bucket(self):
+        bucket_key = (self.aws_client.account_id, self.region_name, self.bucket_name)
+        with known_lock:
+            if bucket_key in known_buckets:
+                return
+
+        kwargs = dict(Bucket=self.bucket_name, ACL='private')
+        # us-east-1 is the default location and rejects an explicit constraint
+        if self.region_name and self.region_name != 'us-east-1':
+            kwargs['CreateBucketConfiguration'] = {'LocationConstraint': self.region_name}
+        try:
+            self.aws_client.call("create_bucket", query="@", **kwargs)
+            logger.info("created bucket {}".format(self.bucket_name))
+        except ClientError as e:
+            if e.response['Error']['Code'] not in ["BucketAlreadyOwnedByYou", "BucketAlreadyExists"]:
+                raise e
+
+        with known_lock:
+            known_buckets.add(bucket_key)
+
+    def template_key(self, body):
+        return "{}/{}".format(TEMPLATE_PREFIX, hashlib.sha256(body.encode('utf-8')).hexdigest())
+
+    def template_url(self, key):
+        if self.region_name and self.region_name != 'us-east-1':
+            return "https://{}.s3.{}.amazonaws.com/{}".format(self.bucket_name, self.region_name, key)
+        return "https://" + self.bucket_name + ".s3.amazonaws.com/" + key
+
+    def object_exists(self, key):
+        try:
+            self.aws_client.call("head_object", query="@", Bucket=self.bucket_name, Key=key)
+            return True
+        except ClientError as e:
+            # a missing bucket answers 404 as well, the upload creates it
+            if e.response['Error']['Code'] in ["404", "NoSuchKey", "NotFound"]:
+                return False
             raise e
 
-    logger.info("created bucket {}".format(s3_bucket_name))
+    def put_template(self, name, body):
+        """
+        Upload a stack template unless the same body is already in the bucket
+        :param name: stack name, kept as object metadata
+        :return: immutable url of the template
+        """
+        key = self.template_key(body)
+        with known_lock:
+            known = (self.bucket_name, key) in uploaded_keys
+
+        if known or self.object_exists(key):
+            logger.info("template of {} already in s3 {}".format(name, key))
+        else:
+            try:
+                self._put_object(name, key, body)
+            except ClientError as e:
+                if e.response['Error']['Code'] != "NoSuchBucket":
+                    raise e
+                self.create_bucket()
+                self._put_object(name, key, body)
+            logger.info("uploaded template of {} to s3 {}".format(name, key))
+
+        with known_lock:
+            uploaded_keys.add((self.bucket_name, key))
+        return self.template_url(key)
 
-def put_template(name, body):
-    aws_client.call("put_object", Body=body, Bucket=s3_bucket_name, Key=name)
-    logger.info("uploaded template to s3 {}".format(name))
-    return "https://" + s3_bucket_name + ".s3.amazonaws.com/"+name
+    def _put_object(self, name, key, body):
+        self.aws_client.call("put_object", Body=body.encode('utf-8'), Bucket=self.bucket_name, Key=key,
+                             ContentType='text/plain', Metadata={'stack-name': name})
 
-def delete_template(name):
-    pass
\ No newline at end of file
+    def delete_template(self, name):
+        pass
@@ -17,7 +17,7 @@ import logging
 import re
 
 from six.moves import zip_longest
-import jmespath
+from common.jmespathhelper import compile_expression
 
 from inventory.resources import find_resource_class, all_services, all_types, all_providers
 
@@ -119,13 +119,12 @@ class Resource(ARNComponent):
         resource_type, resource_id = self._split_resource(self.pattern)
         LOG.debug('resource_type=%s, resource_id=%s',
                   resource_type, resource_id)
-        res = []
         for resource_type in self.matches(context):
             resource_path = '.'.join([provider, service_name, resource_type])
             resource_cls = find_resource_class(resource_path)
-            res.extend(resource_cls.enumerate(
-                self._arn, region, account, resource_id, **kwargs))
-        return res
+            for resource in resource_cls.enumerate(
+                    self._arn, region, account, resource_id, **kwargs):
+                yield resource
 
 
 class Account(ARNComponent):
@@ -288,7 +287,7 @@ class ARN(object):
     def _build_components_from_string(self, arn_string):
         if '|' in arn_string:
             arn_string, query = arn_string.split('|')
-            self.query = jmespath.compile(query)
+            self.query = compile_expression(query)
         pairs = zip_longest(
             self.ComponentClasses, arn_string.split(':', 5), fillvalue='*')
         self._components = [c(n, self) for c, n in pairs]
@@ -16,7 +16,7 @@ import logging
 import datetime
 from collections import namedtuple
 
-import jmespath
+from common import jmespathhelper
 
 import common.awsclient as awsclient
 from inventory.resources.resource import Resource
@@ -128,7 +128,7 @@ class AWSResource(Resource):
                     'list_metrics',
                     Dimensions=[{'Name': self.Meta.dimension,
                                  'Value': self._id}])
-                self._metrics = jmespath.search('Metrics', data)
+                self._metrics = jmespathhelper.search('Metrics', data)
             else:
                 self._metrics = []
         return self._metrics
@@ -241,7 +241,7 @@ class AWSResource(Resource):
                 MetricName=metric['MetricName'],
                 StartTime=start.isoformat(), EndTime=end.isoformat(),
                 Statistics=statistics, Period=period)
-            return MetricData(jmespath.search('Datapoints', data),
+            return MetricData(jmespathhelper.search('Datapoints', data),
                               period)
         else:
             raise ValueError('Metric (%s) not available' % metric_name)
@@ -12,7 +12,7 @@
 # ANY KIND, either express or implied. See the License for the specific
 # language governing permissions and limitations under the License.
 
-import jmespath
+from common.jmespathhelper import compile_expression
 
 from inventory.resources.aws import AWSResource
 
@@ -33,7 +33,7 @@ class AutoScalingGroup(AWSResource):
 
     def __init__(self, client, data, query=None):
         super(AutoScalingGroup, self).__init__(client, data, query)
-        self._arn_query = jmespath.compile('AutoScalingGroupARN')
+        self._arn_query = compile_expression('AutoScalingGroupARN')
 
     @property
     def arn(self):
@@ -57,7 +57,7 @@ class LaunchConfiguration(AWSResource):
 
     def __init__(self, client, data, query=None):
         super(LaunchConfiguration, self).__init__(client, data, query)
-        self._arn_query = jmespath.compile('LaunchConfigurationARN')
+        self._arn_query = compile_expression('LaunchConfigurationARN')
 
     @property
     def arn(self):
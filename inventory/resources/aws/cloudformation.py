@@ -10,7 +10,7 @@
 # distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
 # ANY KIND, either express or implied. See the License for the specific
 # language governing permissions and limitations under the License.
-import jmespath
+from common import jmespathhelper
 
 from inventory.resources.aws import AWSResource
 
@@ -33,7 +33,7 @@ class Stack(AWSResource):
                         'type': stack_resource['ResourceType']
                     }
                 )
-        return resources
+            yield stack
 
     class Meta(object):
         service = 'cloudformation'
@@ -57,7 +57,7 @@ class Stack(AWSResource):
         params = {param_name: self.id}
         if not self._resources:
             data = self._client.call(detail_op, **params)
-            self._resources = jmespath.search(detail_path, data)
+            self._resources = jmespathhelper.search(detail_path, data)
         for resource in self._resources:
             yield resource
 
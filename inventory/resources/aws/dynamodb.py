@@ -14,7 +14,7 @@
 
 import logging
 
-import jmespath
+from common import jmespathhelper
 
 from inventory.resources.aws import AWSResource
 
@@ -46,4 +46,4 @@ class Table(AWSResource):
         detail_op, param_name, detail_path = self.Meta.detail_spec
         params = {param_name: self.id}
         data = client.call(detail_op, **params)
-        self.data = jmespath.search(detail_path, data)
+        self.data = jmespathhelper.search(detail_path, data)
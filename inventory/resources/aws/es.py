@@ -12,7 +12,7 @@
 # ANY KIND, either express or implied. See the License for the specific
 # language governing permissions and limitations under the License.
 
-import jmespath
+from common import jmespathhelper
 
 from inventory.resources.aws import AWSResource
 
@@ -37,4 +37,4 @@ class ElasticsearchDomain(AWSResource):
         detail_op, param_name, detail_path = self.Meta.detail_spec
         params = {param_name: self.id}
         data = client.call(detail_op, **params)
-        self.data = jmespath.search(detail_path, data)
+        self.data = jmespathhelper.search(detail_path, data)
@@ -11,7 +11,7 @@
 
 from inventory.resources.aws import AWSResource
 
-import jmespath
+from common import jmespathhelper
 
 class DeliveryStream(AWSResource):
 
@@ -33,4 +33,4 @@ class DeliveryStream(AWSResource):
         detail_op, param_name, detail_path = self.Meta.detail_spec
         params = {param_name: self.id}
         data = client.call(detail_op, **params)
-        self.data = jmespath.search(detail_path, data)
+        self.data = jmespathhelper.search(detail_path, data)
@@ -32,7 +32,7 @@ class Function(AWSResource):
             response = r._client.call('list_event_source_mappings', **kwargs)
             for esm in response['EventSourceMappings']:
                 r.data['EventSources'].append(esm['EventSourceArn'])
-        return resources
+            yield r
 
     class Meta(object):
         service = 'lambda'
@@ -10,7 +10,7 @@
 # distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
 # ANY KIND, either express or implied. See the License for the specific
 # language governing permissions and limitations under the License.
-import jmespath
+from common import jmespathhelper
 import logging
 
 from inventory.resources.aws import AWSResource
@@ -27,7 +27,6 @@ class Bucket(AWSResource):
         resources = super(Bucket, cls).enumerate(arn, region, account,
                                                  resource_id,
                                                  **kwargs)
-        region_resources = []
         if region is None:
             region = 'us-east-1'
         for r in resources:
@@ -39,12 +38,11 @@ class Bucket(AWSResource):
                 location = response.get('LocationConstraint', 'us-east-1')
                 if location is None:
                     location = 'us-east-1'
-                if location is 'EU':
+                if location == 'EU':
                     location = 'eu-west-1'
                 cls._location_cache[r.id] = location
             if location == region:
-                region_resources.append(r)
-        return region_resources
+                yield r
 
     class Meta(object):
         service = 's3'
@@ -67,6 +65,6 @@ class Bucket(AWSResource):
         params = {param_name: self.id}
         if not self._keys:
             data = self._client.call(detail_op, **params)
-            self._keys = jmespath.search(detail_path, data)
+            self._keys = jmespathhelper.search(detail_path, data)
         for key in self._keys:
             yield key
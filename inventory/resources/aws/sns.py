@@ -11,7 +11,7 @@
 
 import logging
 
-import jmespath
+from common import jmespathhelper
 
 from inventory.resources.aws import AWSResource
 
@@ -51,7 +51,7 @@ class Topic(AWSResource):
         params = {param_name: data['TopicArn']}
         data = client.call(detail_op, **params)
 
-        self.data = jmespath.search(detail_path, data)
+        self.data = jmespathhelper.search(detail_path, data)
 
 
 class Subscription(AWSResource):
@@ -80,7 +80,7 @@ class Subscription(AWSResource):
         resources = super(Subscription, cls).enumerate(
             arn, region, account, resource_id, **kwargs)
 
-        return [r for r in resources if r.id not in cls.invalid_arns]
+        return (r for r in resources if r.id not in cls.invalid_arns)
 
     def __init__(self, client, data, query=None):
         super(Subscription, self).__init__(client, data, query)
@@ -96,4 +96,4 @@ class Subscription(AWSResource):
         params = {param_name: data['SubscriptionArn']}
         data = client.call(detail_op, **params)
 
-        self.data = jmespath.search(detail_path, data)
+        self.data = jmespathhelper.search(detail_path, data)
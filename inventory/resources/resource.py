@@ -1,5 +1,5 @@
 import logging
-import jmespath
+from common import jmespathhelper
 from common.awsclient import AWSClient
 
 from botocore.exceptions import ClientError
@@ -9,8 +9,27 @@ LOG = logging.getLogger(__name__)
 
 class Resource(object):
 
+    def __init_subclass__(cls, **kwargs):
+        """
+        Compile the jmespath expressions of the Meta specs once, when the resource class is defined
+        """
+        super().__init_subclass__(**kwargs)
+        meta = getattr(cls, 'Meta', None)
+        expressions = [getattr(meta, 'name', None), getattr(meta, 'date', None)]
+        for spec, index in (('enum_spec', 1), ('detail_spec', 2), ('tags_spec', 1)):
+            spec = getattr(meta, spec, None)
+            if spec and len(spec) > index:
+                expressions.append(spec[index])
+        for expression in expressions:
+            if isinstance(expression, str):
+                jmespathhelper.compile_expression(expression)
+
     @classmethod
     def enumerate(cls, arn, region, account, resource_id=None, **kwargs):
+        """
+        Generator over the resources of this type, resources are created page by page
+        as the enumeration operation returns them.
+        """
         client = AWSClient(cls.Meta.service, region, **kwargs)
         kwargs = {}
         do_client_side_filtering = False
@@ -33,16 +52,8 @@ class Resource(object):
             kwargs.update(extra_args)
         LOG.debug('enum_op=%s' % enum_op)
         try:
-            data = client.call(enum_op, query=path, **kwargs)
-        except ClientError as e:
-            data = {}
-            # if the error is because the resource was not found, be quiet
-            if 'NotFound' not in e.response['Error']['Code']:
-                raise
-        LOG.debug(data)
-        resources = []
-        if data:
-            for d in data:
+            for d in client.iter_call(enum_op, query=path, **kwargs):
+                LOG.debug(d)
                 if do_client_side_filtering:
                     # If the API does not support filtering, the resource
                     # class should provide a filter method that will
@@ -50,8 +61,11 @@ class Resource(object):
                     # resource ID we are looking for.
                     if not cls.filter(arn, resource_id, d):
                         continue
-                resources.append(cls(client, d, arn.query))
-        return resources
+                yield cls(client, d, arn.query)
+        except ClientError as e:
+            # if the error is because the resource was not found, be quiet
+            if 'NotFound' not in e.response['Error']['Code']:
+                raise
 
     class Meta(object):
         type = 'resource'
@@ -96,7 +110,7 @@ class Resource(object):
     @property
     def name(self):
         if not self._name:
-            self._name = jmespath.search(self.Meta.name, self.data)
+            self._name = jmespathhelper.search(self.Meta.name, self.data)
         return self._name
 
     @property
@@ -106,7 +120,7 @@ class Resource(object):
     @property
     def date(self):
         if not self._date:
-            self._date = jmespath.search(self.Meta.date, self.data)
+            self._date = jmespathhelper.search(self.Meta.date, self.data)
         return self._date
 
     @property
@@ -19,7 +19,7 @@ def init():
 def main():
   parser = argparse.ArgumentParser(description="Stormation to manage cloud formation!")
 
-  parser.add_argument("command", choices=["create", "update", "delete"])
+  parser.add_argument("command", choices=["create", "update", "delete", "compile", "plan", "preview"])
 
   parser.add_argument("-b", "--bundle", type=str, nargs=1,
                       metavar="bundle_name", required=True,
@@ -29,21 +29,62 @@ def main():
                       metavar="stack_name", default=None,
                       help="Stack name in the bundle to processs.")
 
+  parser.add_argument("-p", "--max-parallel", type=int, default=None,
+                      metavar="count",
+                      help="Maximum number of stacks deployed at the same time.")
+
+  parser.add_argument("--continue-on-error", action="store_true",
+                      help="Keep deploying stacks that do not depend on a failed stack.")
+
+  parser.add_argument("-f", "--force", action="store_true",
+                      help="Deploy stacks even if they did not change since the last deployment.")
+
+  parser.add_argument("-j", "--jobs", type=int, default=None,
+                      help="Number of processes rendering stack templates ahead of deployment.")
+
+  parser.add_argument("-y", "--yes", action="store_true",
+                      help="Delete without asking for confirmation.")
+
+  parser.add_argument("--resume", action="store_true",
+                      help="Continue an interrupted create or update, skipping stacks it completed.")
+
+  parser.add_argument("--offline", action="store_true",
+                      help="Compile with the stack outputs stored by earlier runs instead of reading them from AWS.")
+
   args = parser.parse_args(sys.argv[1:])
 
   command = args.command
   bundleFile = get_path(args.bundle[0])
   stackName = args.stack[0] if args.stack else None
 
-  from cfn.cfn_bundle import CFBundle
-  bundle = CFBundle(bundleFile)
+  from cfn.cfn_fanout import load_bundle
+  from cfn.cfn_scheduler import StackScheduler
+  bundle = load_bundle(bundleFile,
+                       max_parallel_stacks=args.max_parallel,
+                       on_failure=StackScheduler.CONTINUE if args.continue_on_error else None,
+                       force=args.force,
+                       offline=args.offline,
+                       compile_workers=args.jobs,
+                       resume=args.resume)
 
   if command == "create":
-      bundle.create_update_bundle()
+      results = bundle.create_update_bundle()
+      if StackScheduler.failed(results):
+          sys.exit(1)
+  elif command == "compile":
+      bundle.compile_bundle(stackName)
+  elif command == "plan":
+      bundle.print_plan(bundle.plan(stackName))
+  elif command == "preview":
+      bundle.print_preview(bundle.preview(stackName))
   elif command == "update":
-      bundle.update(stackName)
+      results = bundle.update(stackName)
+      if StackScheduler.failed(results):
+          sys.exit(1)
   else:
-      bundle.delete(stackName)
+      results = bundle.delete(stackName, confirmed=args.yes)
+      if StackScheduler.failed(results):
+          sys.exit(1)
 
 if __name__ == '__main__':
   init()